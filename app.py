@@ -3,16 +3,32 @@
 
 """FoodieFinds: Recipe Finder App & Blog"""
 import os
+import time
 import requests
+from datetime import datetime, timedelta
 from flask import Flask, request, render_template, redirect, flash, session, g, jsonify
-from flask_debugtoolbar import DebugToolbarExtension
-from models import db, connect_db, User, FavoriteRecipe, Allergy, DietaryPreference, UserAllergy, UserDiet, UserRecipe
+from models import db, connect_db, User, FavoriteRecipe, Allergy, DietaryPreference, UserAllergy, UserDiet, UserRecipe, CachedRecipe
 from forms import AddUserForm, LoginForm, EditForm, IngredientSearchForm, AddRecipeForm
+from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError
-from bs4 import BeautifulSoup
-from secret import API_KEY
+from sqlalchemy.orm import load_only
+from cache import RecipeCache, SearchCache, FragmentCache
+from http_cache import content_etag, template_version, not_modified, with_etag, cache_control
+from spoonacular import SpoonacularClient, API_BASE_URL, estimate_points
+from quota import QuotaLimiter, QuotaExceeded
+from feed import FeedPools
+from jobs import JobQueue
+from search_index import RecipeIndex
+from reference import reference_data
+from passwords import hasher, HashingBusy
+from metrics import metrics
+from sessions import session_store
+try:
+    from secret import API_KEY
+except ImportError:
+    # No secret.py (e.g. on Render or in the test profile): use the environment.
+    API_KEY = os.environ.get('SPOONACULAR_API_KEY', '')
 
-API_BASE_URL = "https://api.spoonacular.com/recipes"
 API_KEY = API_KEY
 CURR_USER_KEY = "curr_user"
 html_instructions = '<ol><li>'
@@ -24,29 +40,396 @@ allergies = ['Dairy', 'Egg', 'Gluten', 'Grain', 'Peanut', 'Seafood',
 
 app = Flask(__name__)
 
+# "production" skips the debug toolbar and all schema/seed work at startup;
+# run `flask --app app init-db` once per deploy instead. "test" runs on
+# SQLite with cheap password hashing and no CSRF, for benchmarks/.
+app.config['APP_PROFILE'] = os.environ.get('APP_PROFILE', 'development')
+TESTING = app.config['APP_PROFILE'] == 'test'
 app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL','postgresql:///foodiefinds'))
+    os.environ.get('DATABASE_URL',
+                   'sqlite:////tmp/foodiefinds-test.db' if TESTING else 'postgresql:///foodiefinds'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
-app.app_context().push()
-
-app.config['SECRET_KEY'] = 'secret'
+app.config['RECIPE_CACHE_TTL'] = int(os.environ.get('RECIPE_CACHE_TTL', 86400))
+app.config['RECIPE_CACHE_MAX_SIZE'] = int(
+    os.environ.get('RECIPE_CACHE_MAX_SIZE', 512))
+app.config['RECIPE_CACHE_DB_MAX_SIZE'] = int(
+    os.environ.get('RECIPE_CACHE_DB_MAX_SIZE', 5000))
+# How often cache reads write their batched accessed_at updates.
+app.config['CACHE_TOUCH_INTERVAL'] = int(
+    os.environ.get('CACHE_TOUCH_INTERVAL', 60))
+app.config['RECIPE_BULK_CHUNK_SIZE'] = int(
+    os.environ.get('RECIPE_BULK_CHUNK_SIZE', 50))
+app.config['FAVORITE_SNAPSHOT_MAX_AGE'] = int(
+    os.environ.get('FAVORITE_SNAPSHOT_MAX_AGE', 7 * 86400))
+app.config['SPOONACULAR_BASE_URL'] = os.environ.get(
+    'SPOONACULAR_BASE_URL', API_BASE_URL)
+app.config['SPOONACULAR_CONNECT_TIMEOUT'] = float(
+    os.environ.get('SPOONACULAR_CONNECT_TIMEOUT', 3.05))
+app.config['SPOONACULAR_READ_TIMEOUT'] = float(
+    os.environ.get('SPOONACULAR_READ_TIMEOUT', 10))
+app.config['SPOONACULAR_MAX_RETRIES'] = int(
+    os.environ.get('SPOONACULAR_MAX_RETRIES', 2))
+app.config['SPOONACULAR_BACKOFF_FACTOR'] = float(
+    os.environ.get('SPOONACULAR_BACKOFF_FACTOR', 0.5))
+app.config['SPOONACULAR_POOL_SIZE'] = int(
+    os.environ.get('SPOONACULAR_POOL_SIZE', 10))
+app.config['SPOONACULAR_DAILY_POINTS'] = float(
+    os.environ.get('SPOONACULAR_DAILY_POINTS', 150))
+app.config['SPOONACULAR_RATE_PER_SECOND'] = float(
+    os.environ.get('SPOONACULAR_RATE_PER_SECOND', 1))
+app.config['SPOONACULAR_BURST'] = int(os.environ.get('SPOONACULAR_BURST', 5))
+app.config['SPOONACULAR_MAX_WAIT'] = float(
+    os.environ.get('SPOONACULAR_MAX_WAIT', 2))
+app.config['SPOONACULAR_CONCURRENCY'] = int(
+    os.environ.get('SPOONACULAR_CONCURRENCY', 4))
+app.config['SPOONACULAR_DEADLINE'] = float(
+    os.environ.get('SPOONACULAR_DEADLINE', 15))
+app.config['FEED_POOL_SIZE'] = int(os.environ.get('FEED_POOL_SIZE', 100))
+app.config['FEED_POOL_MAX_AGE'] = int(
+    os.environ.get('FEED_POOL_MAX_AGE', 6 * 3600))
+app.config['FEED_POOL_MAX_DRAWS'] = int(
+    os.environ.get('FEED_POOL_MAX_DRAWS', 200))
+app.config['FEED_POOL_RELOAD_INTERVAL'] = int(
+    os.environ.get('FEED_POOL_RELOAD_INTERVAL', 60))
+app.config['SEARCH_CACHE_TTL'] = int(os.environ.get('SEARCH_CACHE_TTL', 3600))
+app.config['SEARCH_CACHE_MAX_SIZE'] = int(
+    os.environ.get('SEARCH_CACHE_MAX_SIZE', 256))
+app.config['SEARCH_CACHE_DB_MAX_SIZE'] = int(
+    os.environ.get('SEARCH_CACHE_DB_MAX_SIZE', 2000))
+app.config['SEARCH_RESULTS_PER_QUERY'] = int(
+    os.environ.get('SEARCH_RESULTS_PER_QUERY', 50))
+app.config['SEARCH_PAGE_SIZE'] = 10
+app.config['SEARCH_INDEX_MAX_AGE'] = int(
+    os.environ.get('SEARCH_INDEX_MAX_AGE', 300))
+app.config['SCORER_MAX_AGE'] = int(os.environ.get('SCORER_MAX_AGE', 300))
+app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', 50))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_RETRY_DELAY'] = int(os.environ.get('JOB_RETRY_DELAY', 30))
+app.config['JOB_LOCK_TIMEOUT'] = int(os.environ.get('JOB_LOCK_TIMEOUT', 300))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+app.config['RECIPE_REFRESH_INTERVAL'] = int(
+    os.environ.get('RECIPE_REFRESH_INTERVAL', 600))
+app.config['RECIPE_REFRESH_AHEAD'] = int(
+    os.environ.get('RECIPE_REFRESH_AHEAD', 3600))
+app.config['RECIPE_REFRESH_BATCH'] = int(
+    os.environ.get('RECIPE_REFRESH_BATCH', 50))
+app.config['RECIPE_REFRESH_RECENT'] = int(
+    os.environ.get('RECIPE_REFRESH_RECENT', 21600))
+app.config['RECIPE_REFRESH_MAX_POINTS'] = float(
+    os.environ.get('RECIPE_REFRESH_MAX_POINTS', 10))
+app.config['FEED_WARM_INTERVAL'] = int(os.environ.get('FEED_WARM_INTERVAL', 900))
+app.config['PREFETCH_ENABLED'] = os.environ.get(
+    'PREFETCH_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['PREFETCH_DEPTH'] = int(os.environ.get('PREFETCH_DEPTH', 5))
+app.config['PREFETCH_MIN_POINTS_LEFT'] = float(
+    os.environ.get('PREFETCH_MIN_POINTS_LEFT', 30))
+app.config['PREFETCH_MAX_AGE'] = int(os.environ.get('PREFETCH_MAX_AGE', 60))
+app.config['BCRYPT_LOG_ROUNDS'] = int(
+    os.environ.get('BCRYPT_LOG_ROUNDS', 4 if TESTING else 12))
+app.config['PASSWORD_HASH_CONCURRENCY'] = int(
+    os.environ.get('PASSWORD_HASH_CONCURRENCY', 4))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(
+    os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+app.config['RECIPE_PAGE_CACHE_CONTROL'] = os.environ.get(
+    'RECIPE_PAGE_CACHE_CONTROL', 'private, no-cache')
+app.config['LIST_PAGE_CACHE_CONTROL'] = os.environ.get(
+    'LIST_PAGE_CACHE_CONTROL', 'private, no-store')
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = int(
+    os.environ.get('STATIC_MAX_AGE', 3600))
+app.config['FRAGMENT_CACHE_ENABLED'] = os.environ.get(
+    'FRAGMENT_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+app.config['FRAGMENT_CACHE_MAX_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_MAX_SIZE', 512))
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+app.config['TEMPLATE_VERSION'] = template_version(app)
+# Requests sent with `X-Profile: <PROFILER_TOKEN>` are stack-sampled.
+app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN', '')
+app.config['PROFILER_INTERVAL'] = float(
+    os.environ.get('PROFILER_INTERVAL', 0.005))
+app.config['PROFILER_DIR'] = os.environ.get(
+    'PROFILER_DIR', '/tmp/foodiefinds-profiles')
+# Sessions live server-side ("database" or, for one process, "memory");
+# see sessions.py. The cookie only carries the session id.
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'database')
+app.config['SESSION_TTL'] = int(os.environ.get('SESSION_TTL', 14 * 86400))
+app.config['SESSION_CACHE_SIZE'] = int(os.environ.get('SESSION_CACHE_SIZE', 10000))
+app.config['SESSION_CACHE_TTL'] = int(os.environ.get('SESSION_CACHE_TTL', 10))
+app.config['SESSION_PURGE_INTERVAL'] = int(
+    os.environ.get('SESSION_PURGE_INTERVAL', 3600))
+
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'secret')
 # app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-debug = DebugToolbarExtension(app)
 
 connect_db(app)
-db.create_all()
+hasher.init_app(app)
+metrics.init_app(app)
+session_store.init_app(app)
+
+reference_data.watch()
+app.jinja_env.filters['allergy_type'] = reference_data.allergy_type
+app.jinja_env.filters['diet_type'] = reference_data.diet_type
+
+
+quota_limiter = QuotaLimiter(
+    daily_points=app.config['SPOONACULAR_DAILY_POINTS'],
+    rate=app.config['SPOONACULAR_RATE_PER_SECOND'],
+    burst=app.config['SPOONACULAR_BURST'],
+    max_wait=app.config['SPOONACULAR_MAX_WAIT'])
+
+spoonacular = SpoonacularClient(
+    API_KEY,
+    base_url=app.config['SPOONACULAR_BASE_URL'],
+    limiter=quota_limiter,
+    connect_timeout=app.config['SPOONACULAR_CONNECT_TIMEOUT'],
+    read_timeout=app.config['SPOONACULAR_READ_TIMEOUT'],
+    max_retries=app.config['SPOONACULAR_MAX_RETRIES'],
+    backoff_factor=app.config['SPOONACULAR_BACKOFF_FACTOR'],
+    pool_size=app.config['SPOONACULAR_POOL_SIZE'],
+    concurrency=app.config['SPOONACULAR_CONCURRENCY'],
+    deadline=app.config['SPOONACULAR_DEADLINE'],
+    observer=metrics.observe_api)
+
+
+def fetch_recipe_information_bulk(recipe_ids):
+    """Bulk loader for the recipe cache, chunked by RECIPE_BULK_CHUNK_SIZE."""
+
+    return spoonacular.information_bulk(
+        recipe_ids, chunk_size=app.config['RECIPE_BULK_CHUNK_SIZE'])
+
+
+recipe_cache = RecipeCache(
+    spoonacular.recipe_information,
+    bulk_loader=fetch_recipe_information_bulk,
+    ttl=app.config['RECIPE_CACHE_TTL'],
+    max_size=app.config['RECIPE_CACHE_MAX_SIZE'],
+    db_max_size=app.config['RECIPE_CACHE_DB_MAX_SIZE'],
+    touch_interval=app.config['CACHE_TOUCH_INTERVAL'])
+
+
+job_queue = JobQueue(
+    max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+    retry_delay=app.config['JOB_RETRY_DELAY'],
+    lock_timeout=app.config['JOB_LOCK_TIMEOUT'])
+
+
+def search_feed_recipes(user_allergies, user_diet, number):
+    """Fetch `number` random recipes for a home page feed pool."""
+
+    data = spoonacular.complex_search(
+        intolerances=','.join(user_allergies),
+        diet=','.join(user_diet),
+        number=number,
+        sort='random')
+    return [{"name": recipe["title"], "id": recipe.get("id", "")}
+            for recipe in data["results"]]
+
+
+feed_pools = FeedPools(
+    search_feed_recipes,
+    pool_size=app.config['FEED_POOL_SIZE'],
+    max_age=app.config['FEED_POOL_MAX_AGE'],
+    max_draws=app.config['FEED_POOL_MAX_DRAWS'],
+    reload_interval=app.config['FEED_POOL_RELOAD_INTERVAL'],
+    queue=job_queue)
+
+
+def search_recipes(query, user_allergies, user_diet):
+    """Fetch SEARCH_RESULTS_PER_QUERY results for a normalized search."""
+
+    data = spoonacular.complex_search(
+        intolerances=','.join(user_allergies),
+        diet=','.join(user_diet),
+        number=app.config['SEARCH_RESULTS_PER_QUERY'],
+        query=query,
+        sort='random')
+    return [{"name": recipe["title"], "id": recipe.get("id", "")}
+            for recipe in data["results"]]
+
+
+search_cache = SearchCache(
+    search_recipes,
+    ttl=app.config['SEARCH_CACHE_TTL'],
+    max_size=app.config['SEARCH_CACHE_MAX_SIZE'],
+    db_max_size=app.config['SEARCH_CACHE_DB_MAX_SIZE'],
+    touch_interval=app.config['CACHE_TOUCH_INTERVAL'])
+
+
+recipe_index = RecipeIndex(max_age=app.config['SEARCH_INDEX_MAX_AGE'])
+recipe_index.watch(recipe_cache)
+
+
+# Built on first use: scoring pulls in NumPy, which most requests never need.
+recipe_scorer = None
+
+
+fragment_cache = FragmentCache(
+    enabled=app.config['FRAGMENT_CACHE_ENABLED'],
+    max_size=app.config['FRAGMENT_CACHE_MAX_SIZE'],
+    ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+
+@metrics.add_gauges
+def cache_gauges():
+    """Cache hit ratios and sizes for /metrics."""
+
+    for name, cache in (('recipe', recipe_cache), ('search', search_cache),
+                        ('session', session_store)):
+        stats = cache.stats()
+        yield ('foodiefinds_cache_hit_ratio', 'Cache hit ratio since process start.',
+               {'cache': name}, stats['hit_ratio'])
+        yield ('foodiefinds_cache_memory_entries', 'Entries in the in-memory cache tier.',
+               {'cache': name}, stats['memory_size'])
+
+    stats = fragment_cache.stats()
+    lookups = stats['hits'] + stats['misses']
+    yield ('foodiefinds_cache_hit_ratio', 'Cache hit ratio since process start.',
+           {'cache': 'fragment'}, round(stats['hits'] / lookups, 4) if lookups else 0.0)
+    yield ('foodiefinds_cache_memory_entries', 'Entries in the in-memory cache tier.',
+           {'cache': 'fragment'}, stats['size'])
+
+
+def local_recipes(user, query=None, number=10):
+    """Pick cached recipes when Spoonacular can't be called.
+
+    With a `query` the best ingredient matches come first; without one
+    recipes are drawn at random. Only recipes that fit the user's allergy
+    and diet masks are returned.
+    """
+
+    global recipe_scorer
+    if recipe_scorer is None:
+        from scoring import RecipeScorer
+        recipe_scorer = RecipeScorer(recipe_index,
+                                     max_age=app.config['SCORER_MAX_AGE'])
+
+    return recipe_scorer.rank(user.allergy_mask, user.diet_mask, query=query,
+                              limit=number, shuffle=not query)
+
+
+def keyset_page(query, column, after):
+    """Return one page of `query` ordered by `column`, starting after `after`.
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+
+    page_size = app.config['LIST_PAGE_SIZE']
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(page_size + 1).all()
+
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, getattr(rows[-1], column.key)
+    return rows, None
+
+
+##################################################################################
+# Background jobs, run by worker.py
+
+
+def schedule_prefetch(recipes):
+    """Queue a speculative fetch of the first PREFETCH_DEPTH listed recipes.
+
+    Only runs with PREFETCH_ENABLED. Each user has at most one pending
+    prefetch; a new result list cancels the previous one if it hasn't
+    started yet. Nothing is queued once fewer than
+    PREFETCH_MIN_POINTS_LEFT quota points are left.
+    """
+
+    if not app.config['PREFETCH_ENABLED'] or not g.user:
+        return
+
+    recipe_ids = [recipe['id'] for recipe in recipes
+                  if recipe.get('id') and recipe.get('source', 'spoonacular') == 'spoonacular'
+                  ][:app.config['PREFETCH_DEPTH']]
+    if not recipe_ids:
+        return
+    if quota_limiter.points_left() < app.config['PREFETCH_MIN_POINTS_LEFT']:
+        return
+
+    dedup_key = f'prefetch:{g.user.id}'
+    job_queue.cancel(dedup_key)
+    job_queue.enqueue('prefetch_recipes',
+                      {'recipe_ids': recipe_ids, 'queued_at': time.time()},
+                      dedup_key=dedup_key)
+
+
+@job_queue.task('prefetch_recipes')
+def prefetch_recipes(recipe_ids, queued_at=None):
+    """Speculatively cache recipe information for `recipe_ids`.
+
+    Skipped if the job waited longer than PREFETCH_MAX_AGE (the user has
+    likely moved on) or the quota reserve has been reached since.
+    """
+
+    if queued_at is not None and time.time() - queued_at > app.config['PREFETCH_MAX_AGE']:
+        return
+    if quota_limiter.points_left() < app.config['PREFETCH_MIN_POINTS_LEFT']:
+        return
+    recipe_cache.prefetch(recipe_ids)
+
+
+def bulk_points(recipe_ids):
+    """Estimated quota points for fetching `recipe_ids` in bulk."""
+
+    chunk_size = app.config['RECIPE_BULK_CHUNK_SIZE']
+    return sum(estimate_points('informationBulk',
+                               {'ids': ','.join(map(str, recipe_ids[i:i + chunk_size]))})
+               for i in range(0, len(recipe_ids), chunk_size))
+
+
+@job_queue.task('refresh_stale_recipes')
+def refresh_stale_recipes():
+    """Re-fetch recently read recipes that are about to expire.
+
+    Only rows read within RECIPE_REFRESH_RECENT seconds qualify; the rest
+    expire and are fetched again if someone asks for them. A run spends at
+    most RECIPE_REFRESH_MAX_POINTS and never dips into the last
+    PREFETCH_MIN_POINTS_LEFT points of the day.
+    """
+
+    budget = min(app.config['RECIPE_REFRESH_MAX_POINTS'],
+                 quota_limiter.points_left() - app.config['PREFETCH_MIN_POINTS_LEFT'])
+    if budget < 1:
+        return
+
+    now = datetime.utcnow()
+    soon = now + timedelta(seconds=app.config['RECIPE_REFRESH_AHEAD'])
+    recent = now - timedelta(seconds=app.config['RECIPE_REFRESH_RECENT'])
+    recipe_ids = [recipe_id for recipe_id, in db.session.query(CachedRecipe.recipe_id)
+                  .filter(CachedRecipe.expires_at < soon,
+                          CachedRecipe.accessed_at >= recent)
+                  .order_by(CachedRecipe.accessed_at.desc())
+                  .limit(app.config['RECIPE_REFRESH_BATCH'])]
+    while recipe_ids and bulk_points(recipe_ids) > budget:
+        recipe_ids.pop()
+    if recipe_ids:
+        recipe_cache.set_many(fetch_recipe_information_bulk(recipe_ids))
+
+
+@job_queue.task('refresh_favorite_snapshots')
+def refresh_favorite_snapshots(user_id, recipe_ids):
+    """Re-fetch recipe information and update the user's favorite snapshots."""
+
+    recipes = recipe_cache.get_many(recipe_ids)
+    fav_recipes = FavoriteRecipe.query.filter(
+        FavoriteRecipe.user_id == user_id,
+        FavoriteRecipe.recipe_id.in_(list(recipes))).all()
+    for fav_recipe in fav_recipes:
+        fav_recipe.update_snapshot(recipes[fav_recipe.recipe_id])
+    db.session.commit()
 
 
-# Seed diets and allergies only if empty
-if not DietaryPreference.query.first():
-    for diet in diets:
-        db.session.add(DietaryPreference(type=diet))
-if not Allergy.query.first():
-    for allergy in allergies:
-        db.session.add(Allergy(type=allergy))
+job_queue.task('fill_feed_pool')(feed_pools.fill)
+job_queue.task('warm_feed_pools')(feed_pools.warm)
 
-db.session.commit()
+
+@job_queue.task('purge_sessions')
+def purge_sessions():
+    """Delete expired sessions and user context snapshots."""
+
+    session_store.purge_expired()
 
 
 @app.before_request
@@ -54,7 +437,8 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        # A cached snapshot (sessions.UserContext), not a User row.
+        g.user = session_store.user_context(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -64,6 +448,8 @@ def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    # New session id for the new user, against session fixation.
+    session.regenerate = True
 
 
 def do_logout():
@@ -71,9 +457,11 @@ def do_logout():
 
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
+        session.regenerate = True
 
 
 @app.route('/', methods=['GET'])
+@cache_control('LIST_PAGE_CACHE_CONTROL')
 def fetch_and_populate():
     """Fetch data from the API if logged in user"""
     if not g.user:
@@ -85,21 +473,31 @@ def fetch_and_populate():
             user_allergies = []
         if not user_diet:
             user_diet = []
-        response = requests.get(
-            f'{API_BASE_URL}/complexSearch',
-            params={
-                'intolerances': ','.join(user_allergies),
-                'diet': user_diet,
-                'number': 10,
-                'apiKey': API_KEY,
-                'sort': 'random'
-            })
-        data = response.json()
-        recipe_data = data["results"]
-        recipe_list = [{"name": recipe["title"], "id": recipe.get(
-            "id", "")} for recipe in recipe_data]
+        try:
+            recipe_list = feed_pools.draw(user_allergies, user_diet)
+            schedule_prefetch(recipe_list)
+        except QuotaExceeded:
+            flash("Daily recipe limit reached, showing saved recipes.", "info")
+            recipe_list = local_recipes(g.user)
+        except requests.RequestException:
+            flash("Unable to load recipes right now. Try again soon.", "warning")
+            recipe_list = []
         return render_template('home.html', recipe_list=recipe_list)
 
+
+@app.route('/api-stats', methods=['GET'])
+def api_stats():
+    """Spoonacular quota burn, call latency, cache counters and queue depth."""
+
+    return jsonify(quota=quota_limiter.stats(),
+                   spoonacular=spoonacular.stats(),
+                   recipe_cache=recipe_cache.stats(),
+                   search_cache=search_cache.stats(),
+                   prefetch=recipe_cache.prefetch_stats(),
+                   fragments=fragment_cache.stats(),
+                   sessions=session_store.stats(),
+                   jobs=job_queue.stats())
+
 ##################################################################################
 # User Routes
 
@@ -115,8 +513,7 @@ def signup():
     If the there already is a user with that username: flash message
     and re-present form.
     """
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+    do_logout()
     form = AddUserForm()
 
     if form.validate_on_submit():
@@ -132,6 +529,10 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except HashingBusy:
+            flash("We're busy right now, please try again.", 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         flash(f"Welcome, {user.username}", 'success')
@@ -148,10 +549,16 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except HashingBusy:
+            flash("We're busy right now, please try again.", 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # Persists the new hash if authenticate upgraded it.
+            db.session.commit()
             do_login(user)
             flash(f"Welcome back, {user.username}!", "success")
             return redirect("/")
@@ -186,10 +593,16 @@ def view_user_profile(user_id):
 @app.route('/profile/<int:user_id>/edit', methods=["GET", "POST"])
 def edit_user_profile(user_id):
     user = User.query.get_or_404(user_id)
-    allergies = Allergy.query.all()
-    diet_prefs = DietaryPreference.query.all()
+    allergies = reference_data.allergies()
+    diet_prefs = reference_data.diets()
 
-    form = EditForm(request.form, obj=user)
+    # Check the boxes for the user's current restrictions (read off the
+    # masks); on POST the submitted boxes take precedence. Not obj=user:
+    # WTForms would prefer user.allergies, the association rows.
+    form = EditForm(
+        username=user.username, email=user.email,
+        allergies=[allergy_id for allergy_id, _ in allergies if user.has_allergy(allergy_id)],
+        diet_prefs=[diet_id for diet_id, _ in diet_prefs if user.has_diet(diet_id)])
 
     if not g.user:
         flash("Unable to view other users' profiles", "danger")
@@ -198,37 +611,7 @@ def edit_user_profile(user_id):
     if request.method == 'POST' and form.validate_on_submit():
         user.username = form.username.data
         user.email = form.email.data
-
-        allergy_id = int(request.form.get('allergies')) if request.form.get(
-            'allergies') != 'None' else None
-        diet_prefs_id = int(request.form.get('diet_prefs')) if request.form.get(
-            'diet_prefs') != 'None' else None
-
-        if user.has_allergy(allergy_id):
-            flash("Allergy already noted.", "warning")
-            return redirect(f'/profile/{g.user.id}/edit')
-        elif user.has_diet(diet_prefs_id):
-            flash("Dietary Preference already noted.", "warning")
-            return redirect(f'/profile/{g.user.id}/edit')
-        else:
-            user.allergies_id = allergy_id
-            user.diet_prefs_id = diet_prefs_id
-
-        new_allergies = request.form.getlist('allergies')
-        if 'None' not in new_allergies:
-            for allergy_id in new_allergies:
-                if not user.has_allergy(int(allergy_id)):
-                    user_allergy = UserAllergy(
-                        user_id=user.id, allergy_id=int(allergy_id))
-                    db.session.add(user_allergy)
-
-        new_diet_prefs = request.form.getlist('diet_prefs')
-        if 'None' not in new_diet_prefs:
-            for diet_prefs_id in new_diet_prefs:
-                if not user.has_diet(int(diet_prefs_id)):
-                    user_diet_pref = UserDiet(
-                        user_id=user.id, diet_prefs_id=int(diet_prefs_id))
-                    db.session.add(user_diet_pref)
+        user.set_restrictions(form.allergies.data, form.diet_prefs.data)
 
         db.session.commit()
         flash("Profile updated successfully!", "success")
@@ -242,7 +625,7 @@ def delete_user():
 
     if g.user:
         do_logout()
-        db.session.delete(g.user)
+        db.session.delete(db.session.get(User, g.user.id))
         db.session.commit()
         flash(f'{g.user.username} successfully deleted', 'success')
         return redirect("/")
@@ -253,34 +636,46 @@ def delete_user():
 
 
 @app.route('/recipes/<int:recipe_id>', methods=["GET", "POST"])
+@cache_control('RECIPE_PAGE_CACHE_CONTROL')
 def get_recipe_info(recipe_id):
-    """Show recipe details and option to add to favorites."""
+    """Show recipe details and option to add to favorites.
+
+    The ETag covers the cached recipe content, the viewer and whether
+    they have favorited it, so a revisit gets a 304 until one changes.
+    """
     if not g.user:
         flash("Login to view and favorite recipes", "danger")
         return redirect('/login')
 
-    response = requests.get(
-        f'{API_BASE_URL}/{recipe_id}/information?includeNutrition=false&apiKey={API_KEY}')
-
-    if response.status_code == 200:
-        data = response.json()
-        if 'title' in data:
-            title = data['title']
-            if 'image' in data:
-                photo_url = data['image']
-            else:
-                photo_url = ''
-            ingredients = [ingredient['original']
-                           for ingredient in data['extendedIngredients']]
-            instructions_html = data['instructions']
-            soup = BeautifulSoup(instructions_html, 'html.parser')
-            instructions = soup.get_text()
-
-            return render_template('recipes/detail.html', title=title, photo_url=photo_url, ingredients=ingredients, instructions=instructions, recipe_id=recipe_id)
+    try:
+        data = recipe_cache.get(recipe_id)
+    except requests.HTTPError as e:
+        return f"Error: {e.response.status_code}, {e.response}"
+    except requests.RequestException as e:
+        return f"Error: {e}"
+
+    if 'title' in data:
+        title = data['title']
+        if 'image' in data:
+            photo_url = data['image']
         else:
-            return "Title not found in the JSON response."
+            photo_url = ''
+        normalized = data['normalized']
+        is_favorite = recipe_id in g.user.favorite_ids
+        etag = content_etag('recipe', normalized['content_hash'], g.user.id,
+                            g.user.username, is_favorite,
+                            app.config['TEMPLATE_VERSION'])
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        body = fragment_cache.render(
+            'recipes/_detail_body.html', normalized['content_hash'],
+            photo_url=photo_url, ingredients=normalized['ingredients'],
+            steps=normalized['steps'])
+        return with_etag(render_template('recipes/detail.html', title=title, recipe_id=recipe_id, body=body), etag)
     else:
-        return f"Error: {response.status_code}, {response}"
+        return "Title not found in the JSON response."
 
 
 @app.route('/fav-recipes', methods=['GET'])
@@ -290,23 +685,30 @@ def list_fav_recipes_of_g_user():
         flash("Login to add to favorites", "danger")
         return redirect('/login')
 
-    user = User.query.filter_by(id=g.user.id).first()
-    favorite_recipes = []
-
-    for fav_recipe in user.fav_recipes:
+    user = g.user
+    max_age = app.config['FAVORITE_SNAPSHOT_MAX_AGE']
+    fav_recipes, next_cursor = keyset_page(
+        FavoriteRecipe.query.filter_by(user_id=user.id),
+        FavoriteRecipe.recipe_id, request.args.get('after', type=int))
 
-        recipe_id = fav_recipe.recipe_id
-        response = requests.get(
-            f'{API_BASE_URL}/{recipe_id}/information?includeNutrition=false&apiKey={API_KEY}')
-
-        recipe_data = response.json()
-        recipe_name = recipe_data.get('title', 'N/A')
+    favorite_recipes = []
+    stale_ids = []
+    for fav_recipe in fav_recipes:
+        if fav_recipe.is_stale(max_age):
+            stale_ids.append(fav_recipe.recipe_id)
+        favorite_recipes.append({
+            'recipe_id': fav_recipe.recipe_id,
+            'recipe_name': fav_recipe.title or 'N/A',
+            'image': fav_recipe.image,
+            'ready_in_minutes': fav_recipe.ready_in_minutes})
 
-        recipe_info = {'recipe_id': recipe_id, 'recipe_name': recipe_name}
-        favorite_recipes.append(recipe_info)
+    if stale_ids:
+        job_queue.enqueue('refresh_favorite_snapshots',
+                          {'user_id': user.id, 'recipe_ids': stale_ids},
+                          dedup_key=f'favorites:{user.id}')
 
-        # favorite_recipes.append(recipe_id)
-    return render_template('recipes/fav-recipes.html', favorite_recipes=favorite_recipes)
+    return render_template('recipes/fav-recipes.html', favorite_recipes=favorite_recipes,
+                           next_cursor=next_cursor)
 
 
 @app.route('/fav-recipes/<int:recipe_id>', methods=['POST'])
@@ -316,30 +718,29 @@ def add_fav_recipe(recipe_id):
         flash("Login to add to favorites", "danger")
         return redirect('/login')
 
-    response = requests.get(
-        f'{API_BASE_URL}/{recipe_id}/information?includeNutrition=false&apiKey={API_KEY}')
-
-    if response.status_code == 200:
-        data = response.json()
-
-        recipe_name = data.get('title')
-        recipe_id = data.get('id')
+    try:
+        data = recipe_cache.get(recipe_id)
+    except requests.RequestException:
+        flash("Error adding the recipe to favorites", "danger")
+        return redirect(f'/recipes/{recipe_id}')
 
-        new_fav_recipe = FavoriteRecipe(
-            user_id=g.user.id,
-            recipe_id=recipe_id
-        )
+    recipe_name = data.get('title')
+    recipe_id = data.get('id')
 
-        db.session.add(new_fav_recipe)
-        db.session.commit()
+    added = FavoriteRecipe.add(g.user.id, data)
+    if added:
+        session_store.invalidate_user(g.user.id)
+    db.session.commit()
 
+    if added:
         flash(f"{recipe_name} added to favorites!", "success")
-        return redirect(f'/recipes/{recipe_id}')
     else:
-        flash("Error adding the recipe to favorites", "danger")
+        flash(f"{recipe_name} is already in your favorites.", "info")
+    return redirect(f'/recipes/{recipe_id}')
 
 
 @app.route('/search', methods=['GET', 'POST'])
+@cache_control('LIST_PAGE_CACHE_CONTROL')
 def search_ingredient():
     if not g.user:
         flash("Sign up or Log in to search recipes", "danger")
@@ -347,6 +748,11 @@ def search_ingredient():
     form = IngredientSearchForm()
     if request.method == 'POST':
         ingredients = request.form.get('ingredients')
+    else:
+        ingredients = request.args.get('ingredients')
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    if ingredients:
         user_allergies = g.user.get_allergies()
         user_diet = g.user.get_diet()
 
@@ -355,26 +761,40 @@ def search_ingredient():
         if not user_diet:
             user_diet = []
 
-        response = requests.get(
-            f'{API_BASE_URL}/complexSearch',
-            params={
-                'intolerances': ','.join(user_allergies),
-                'diet': ','.join(user_diet),
-                'number': 10,
-                'apiKey': API_KEY,
-                'query': ingredients,
-                'sort': 'random'
-            })
-        if response.status_code == 200:
-            data = response.json()
-            recipe_data = data["results"]
-            recipes = [{"name": recipe["title"], "id": recipe.get(
-                "id", "")} for recipe in recipe_data]
-            if not recipes:  # Check if recipes list is empty
+        page_size = app.config['SEARCH_PAGE_SIZE']
+        recipes = recipe_index.search(
+            ingredients, g.user.allergy_mask, g.user.diet_mask,
+            limit=app.config['SEARCH_RESULTS_PER_QUERY'], user_id=g.user.id)
+
+        if len(recipes) < page_size:
+            # Not enough local matches; top up from Spoonacular.
+            try:
+                remote = search_cache.get(ingredients, user_allergies, user_diet)
+            except QuotaExceeded:
+                flash("Daily recipe limit reached, showing saved recipes.", "info")
+                remote = local_recipes(
+                    g.user, query=ingredients,
+                    number=app.config['SEARCH_RESULTS_PER_QUERY'])
+            except requests.RequestException:
+                remote = None if not recipes else []
+
+            if remote is None:
+                recipes = None
+            else:
+                local_ids = {recipe['id'] for recipe in recipes
+                             if recipe['source'] == 'spoonacular'}
+                recipes = recipes + [recipe for recipe in remote
+                                     if recipe['id'] not in local_ids]
+        if recipes is not None:
+            page_recipes = recipes[(page - 1) * page_size:page * page_size]
+            if not page_recipes:  # Check if recipes list is empty
                 flash(
                     "No recipes found based on your allergies/ dietary preferences.", "warning")
             else:
-                return render_template('recipes/search.html', recipes=recipes, form=form)
+                schedule_prefetch(page_recipes)
+                return render_template('recipes/search.html', recipes=page_recipes, form=form,
+                                       ingredients=ingredients, page=page,
+                                       has_next=len(recipes) > page * page_size)
     return render_template('recipes/search.html', form=form)
 
 
@@ -385,9 +805,11 @@ def unfavorite_recipe(recipe_id):
         flash("You must be logged in.", "danger")
         return redirect("/login")
 
-    fav_recipe = FavoriteRecipe.query.filter_by(
-        user_id=g.user.id, recipe_id=recipe_id).first()
-    db.session.delete(fav_recipe)
+    # A single DELETE, so removing one that's already gone is harmless.
+    removed = FavoriteRecipe.query.filter_by(
+        user_id=g.user.id, recipe_id=recipe_id).delete()
+    if removed:
+        session_store.invalidate_user(g.user.id)
     db.session.commit()
     flash("Recipe removed from favorites!", "success")
     return redirect("/fav-recipes")
@@ -437,8 +859,13 @@ def list_added_recipes_of_g_user():
         flash("Login to add recipes of your own", "danger")
         return redirect('/login')
 
-    user_recipes = UserRecipe.query.filter_by(user_id=g.user.id).all()
-    return render_template('add-recipes/user-recipes.html', user_recipes=user_recipes)
+    # Only id and title are listed; skip the large text columns.
+    user_recipes, next_cursor = keyset_page(
+        UserRecipe.query.options(load_only(UserRecipe.id, UserRecipe.title))
+        .filter_by(user_id=g.user.id),
+        UserRecipe.id, request.args.get('after', type=int))
+    return render_template('add-recipes/user-recipes.html', user_recipes=user_recipes,
+                           next_cursor=next_cursor)
 
 
 @app.route('/add-recipe', methods=['GET', 'POST'])
@@ -474,6 +901,7 @@ def add_recipe():
 
 
 @app.route('/user-recipes/<int:recipe_id>', methods=["GET"])
+@cache_control('RECIPE_PAGE_CACHE_CONTROL')
 def get_user_recipe_info(recipe_id):
     """Show user-added recipe details."""
     if not g.user:
@@ -481,8 +909,18 @@ def get_user_recipe_info(recipe_id):
         return redirect('/login')
 
     user_recipe = UserRecipe.query.get_or_404(recipe_id)
+    version = content_etag('user-recipe', user_recipe.id, user_recipe.title,
+                           user_recipe.photo_url, user_recipe.ingredients,
+                           user_recipe.instructions)
+    etag = content_etag(version, g.user.id, g.user.username,
+                        app.config['TEMPLATE_VERSION'])
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
-    return render_template('add-recipes/show.html', user_recipe=user_recipe)
+    body = fragment_cache.render('add-recipes/_show_body.html', version,
+                                 user_recipe=user_recipe)
+    return with_etag(render_template('add-recipes/show.html', user_recipe=user_recipe, body=body), etag)
 
 
 @app.route('/delete/<int:recipe_id>', methods=["POST"])
@@ -499,3 +937,88 @@ def delete_recipe(recipe_id):
     flash(
         f"{recipe.title} has been deleted.", "success")
     return redirect(f"/user-recipes")
+
+
+##################################################################################
+# Setup
+
+
+def migrate_db(revision='head'):
+    """Upgrade the schema to `revision`, by default the latest in migrations/.
+
+    A database made by `db.create_all()` before there were migrations has
+    the original tables but no alembic_version. It's stamped at the
+    baseline (0001, exactly those tables) and upgraded from there.
+    """
+
+    # Imported here so web workers, which never migrate, don't load Alembic.
+    from alembic import command
+    from alembic.config import Config
+
+    config = Config()
+    config.set_main_option('script_location', os.path.join(app.root_path, 'migrations'))
+    with db.engine.connect() as connection:
+        config.attributes['connection'] = connection
+        tables = inspect(connection).get_table_names()
+        # Alembic must own the transaction to build indexes concurrently.
+        connection.rollback()
+        if 'users' in tables and 'alembic_version' not in tables:
+            command.stamp(config, '0001')
+        command.upgrade(config, revision)
+
+
+def seed_reference_data():
+    """Migrate the schema and seed diets and allergies if they're empty."""
+
+    migrate_db()
+
+    if not DietaryPreference.query.first():
+        for diet in diets:
+            db.session.add(DietaryPreference(type=diet))
+    if not Allergy.query.first():
+        for allergy in allergies:
+            db.session.add(Allergy(type=allergy))
+
+    db.session.commit()
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Run pending migrations and seed the allergy and diet lists."""
+
+    seed_reference_data()
+    print("Database ready.")
+
+
+def create_app(profile=None):
+    """Finish setting up the app for `profile` and return it.
+
+    "development" (the default) installs the debug toolbar and migrates
+    and seeds the database on startup. "production" does neither, so a
+    worker boots without touching the database. "test" migrates and seeds
+    the database and turns off CSRF; its SQLite database and cheap hashing
+    are picked at import, so set APP_PROFILE=test in the environment.
+    "production" refuses to start unless SECRET_KEY is set in the
+    environment, since sessions and CSRF tokens are signed with it.
+    Run with e.g. `gunicorn --threads 8 'app:create_app("production")'`;
+    see passwords.py for why the workers need threads.
+    """
+
+    profile = profile or app.config['APP_PROFILE']
+    if profile == 'production' and not os.environ.get('SECRET_KEY'):
+        raise RuntimeError("Set SECRET_KEY in the environment to run the production profile.")
+    app.config['APP_PROFILE'] = profile
+
+    if profile == 'test':
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        with app.app_context():
+            seed_reference_data()
+
+    if profile == 'development' and 'debugtoolbar' not in app.extensions:
+        from flask_debugtoolbar import DebugToolbarExtension
+        app.extensions['debugtoolbar'] = DebugToolbarExtension(app)
+        with app.app_context():
+            seed_reference_data()
+
+    return app
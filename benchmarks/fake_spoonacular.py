@@ -0,0 +1,155 @@
+"""Local stand-in for the Spoonacular recipes API.
+
+Serves complexSearch, /{id}/information and informationBulk from the
+fixtures in benchmarks/fixtures, with configurable latency and error
+injection, and sends the quota headers the app's limiter reads. Recipes
+for ids not in the fixtures are made from a fixture picked by id, so
+any id resolves. Point the app at it with SPOONACULAR_BASE_URL:
+
+    python benchmarks/fake_spoonacular.py --port 5050 --latency-ms 80 --error-rate 0.02
+    SPOONACULAR_BASE_URL=http://127.0.0.1:5050/recipes flask --app 'app:create_app()' run
+
+GET /_stats returns the calls served per endpoint.
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+
+from flask import Flask, jsonify, request
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEARCH_ID_BASE = 900000
+SEARCH_TOTAL = 500
+
+
+def load_fixtures():
+    with open(os.path.join(FIXTURES, 'information.json')) as f:
+        recipes = json.load(f)
+    with open(os.path.join(FIXTURES, 'complex_search.json')) as f:
+        search = json.load(f)
+    return recipes, search
+
+
+class FakeSpoonacular:
+    """Fixture-backed responses plus latency/error injection and call counts."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.recipes, self.search_fixture = load_fixtures()
+        self.by_id = {recipe['id']: recipe for recipe in self.recipes}
+        self.calls = {}
+        self.points_used = 0.0
+        self._lock = threading.Lock()
+
+    def recipe(self, recipe_id):
+        recipe = self.by_id.get(recipe_id)
+        if recipe is not None:
+            return recipe
+        recipe = copy.deepcopy(self.recipes[recipe_id % len(self.recipes)])
+        recipe['title'] = f"{recipe['title']} #{recipe_id}"
+        recipe['id'] = recipe_id
+        return recipe
+
+    def search(self, query, number, offset):
+        """Stable results for a query: the fixtures first, then synthetic ids."""
+
+        if not query:
+            # sort=random on the home page: any page of the catalogue.
+            offset = self.random.randrange(SEARCH_TOTAL)
+        digest = int(hashlib.sha1((query or '').encode('UTF-8')).hexdigest()[:6], 16)
+        results = []
+        for position in range(offset, min(offset + number, SEARCH_TOTAL)):
+            if position < len(self.search_fixture['results']) and query:
+                results.append(self.search_fixture['results'][position])
+                continue
+            recipe = self.recipe(SEARCH_ID_BASE + (digest + position) % 50000)
+            results.append({'id': recipe['id'], 'title': recipe['title'],
+                            'image': recipe['image'], 'imageType': 'jpg'})
+        return {'offset': offset, 'number': number,
+                'totalResults': SEARCH_TOTAL, 'results': results}
+
+    def before(self, endpoint, points):
+        """Count the call, sleep the injected latency; return an error or None."""
+
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            self.points_used += points
+            fail = self.random.random() < self.error_rate
+            delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if fail:
+            return jsonify(status='failure', code=503,
+                           message='Injected error.'), 503
+        return None
+
+    def quota_headers(self, points):
+        return {'X-API-Quota-Request': str(points),
+                'X-API-Quota-Used': str(round(self.points_used, 2))}
+
+    def stats(self):
+        with self._lock:
+            return {'calls': dict(self.calls), 'points_used': self.points_used}
+
+
+def create_fake_app(fake):
+    """Flask app serving `fake` under /recipes, like api.spoonacular.com."""
+
+    app = Flask(__name__)
+
+    def respond(endpoint, points, body):
+        error = fake.before(endpoint, points)
+        if error is not None:
+            return error
+        return jsonify(body()), 200, fake.quota_headers(points)
+
+    @app.route('/recipes/complexSearch')
+    def complex_search():
+        number = request.args.get('number', 10, type=int)
+        return respond('complexSearch', 1 + 0.01 * number, lambda: fake.search(
+            request.args.get('query', ''), number, request.args.get('offset', 0, type=int)))
+
+    @app.route('/recipes/<int:recipe_id>/information')
+    def information(recipe_id):
+        return respond('information', 1, lambda: fake.recipe(recipe_id))
+
+    @app.route('/recipes/informationBulk')
+    def information_bulk():
+        ids = [int(recipe_id) for recipe_id in request.args.get('ids', '').split(',')
+               if recipe_id]
+        return respond('informationBulk', 1 + 0.5 * (len(ids) - 1),
+                       lambda: [fake.recipe(recipe_id) for recipe_id in ids])
+
+    @app.route('/_stats')
+    def stats():
+        return jsonify(fake.stats())
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fake = FakeSpoonacular(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, seed=args.seed)
+    create_fake_app(fake).run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
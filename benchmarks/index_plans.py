@@ -0,0 +1,179 @@
+"""Check query plans and timings for the per-user lookups on a large database.
+
+Drops every table in DATABASE_URL, migrates to 0004 (before the indexes),
+seeds `--rows` users, user recipes and favorites plus one allergy and diet
+per user, and runs the SQL behind login, the per-request user load,
+/fav-recipes, unfavoriting, /user-recipes and the allergy foreign key
+check. It prints each plan and the median time, then upgrades to the
+latest migration and does it again. Exits non-zero if any of them still
+scans a whole table at the latest migration.
+
+DATABASE_URL must be set explicitly and point at a scratch database:
+
+    DATABASE_URL=postgresql:///foodiefinds_bench python benchmarks/index_plans.py
+    DATABASE_URL=sqlite:////tmp/foodiefinds-plans.db python benchmarks/index_plans.py --rows 200000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if 'DATABASE_URL' not in os.environ:
+    sys.exit("Set DATABASE_URL to a scratch database; every table in it is dropped.")
+os.environ.setdefault('SECRET_KEY', 'index-plans')
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.orm import load_only  # noqa: E402
+
+from app import app, create_app, migrate_db  # noqa: E402
+from models import db, User, FavoriteRecipe, UserAllergy, UserRecipe  # noqa: E402
+
+# The last revision before migration 0005 added the per-user indexes.
+BEFORE_INDEXES = '0004'
+
+SEED = """
+WITH RECURSIVE seq(n) AS (
+    SELECT CAST(1 AS BIGINT) UNION ALL SELECT n + 1 FROM seq WHERE n < :rows)
+INSERT INTO {table} ({columns}) SELECT {values} FROM seq
+"""
+
+# Favorites go to one user in ten, so those users have ten each.
+TABLES = [
+    ('users', 'id, username, email, password, allergy_mask, diet_mask',
+     "n, 'user' || n, 'user' || n || '@example.com', 'x', 0, 0"),
+    ('user_recipes', 'title, ingredients, instructions, user_id',
+     "'Recipe ' || n, 'flour, water', 'Mix.', (n * 7919) % :users + 1"),
+    ('fav_recipes', 'user_id, recipe_id, title, ready_in_minutes',
+     "n % :fav_users + 1, n, 'Recipe ' || n, 30"),
+    ('user_allergies', 'user_id, allergy_id', 'n, n % :allergies + 1'),
+    ('user_diet_prefs', 'user_id, diet_prefs_id', 'n, n % :diets + 1'),
+]
+
+
+def probes(rows, rng):
+    """(name, query factory) pairs; each factory picks a random user."""
+
+    fav_users = max(rows // 10, 1)
+    page = app.config['LIST_PAGE_SIZE'] + 1
+
+    def user_id():
+        return rng.randrange(1, rows + 1)
+
+    def fav_user_id():
+        return rng.randrange(1, fav_users + 1)
+
+    # Only columns that already exist at BEFORE_INDEXES; context_version
+    # comes later.
+    login_columns = load_only(User.id, User.username, User.password)
+    context_columns = load_only(User.id, User.username, User.allergy_mask,
+                                User.diet_mask)
+
+    return [
+        ('login', lambda: User.query.options(login_columns).filter_by(
+            username=f'user{user_id()}')),
+        ('load user', lambda: User.query.options(context_columns).filter_by(
+            id=user_id())),
+        ('load favorite ids', lambda: FavoriteRecipe.query.options(
+            load_only(FavoriteRecipe.recipe_id)).filter(
+            FavoriteRecipe.user_id.in_([fav_user_id()]))),
+        ('/fav-recipes', lambda: FavoriteRecipe.query.filter_by(
+            user_id=fav_user_id()).order_by(FavoriteRecipe.recipe_id).limit(page)),
+        ('unfavorite', lambda: (lambda k: FavoriteRecipe.query.filter_by(
+            user_id=k, recipe_id=k - 1 + fav_users))(fav_user_id())),
+        ('/user-recipes', lambda: UserRecipe.query.options(
+            load_only(UserRecipe.id, UserRecipe.title)).filter_by(
+            user_id=user_id()).order_by(UserRecipe.id).limit(page)),
+        ('user allergies', lambda: UserAllergy.query.filter_by(user_id=user_id())),
+        ('allergy FK check', lambda: UserAllergy.query.filter_by(
+            allergy_id=rng.randrange(1, 13)).limit(1)),
+    ]
+
+
+def explain(query):
+    """Return (plan lines, whether the plan scans a whole table)."""
+
+    sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+    if db.engine.dialect.name == 'postgresql':
+        lines = [row[0] for row in db.session.execute(
+            text(f'EXPLAIN (ANALYZE, BUFFERS) {sql}'))]
+        return lines, any('Seq Scan' in line for line in lines)
+
+    lines = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+    return lines, any(line.startswith('SCAN ') for line in lines)
+
+
+def measure(rows, repeat, verbose):
+    rng = random.Random(0)
+    results = {}
+    for name, make_query in probes(rows, rng):
+        plan, full_scan = explain(make_query())
+        timings = []
+        for _ in range(repeat):
+            query = make_query()
+            start = time.perf_counter()
+            query.all()
+            timings.append((time.perf_counter() - start) * 1000)
+        results[name] = (statistics.median(timings), full_scan)
+        if verbose:
+            print(f"  {name}:")
+            for line in plan:
+                print(f"    {line}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--quiet', action='store_true', help="don't print plans")
+    args = parser.parse_args()
+
+    create_app('production')
+    app.app_context().push()
+
+    db.drop_all()
+    db.session.execute(text('DROP TABLE IF EXISTS alembic_version'))
+    db.session.commit()
+    migrate_db(BEFORE_INDEXES)
+
+    start = time.perf_counter()
+    db.session.execute(text("INSERT INTO allergies (type) VALUES "
+                            + ', '.join(f"('Allergy {i}')" for i in range(12))))
+    db.session.execute(text("INSERT INTO diet_prefs (type) VALUES "
+                            + ', '.join(f"('Diet {i}')" for i in range(11))))
+    params = {'rows': args.rows, 'users': args.rows,
+              'fav_users': max(args.rows // 10, 1), 'allergies': 12, 'diets': 11}
+    for table, columns, values in TABLES:
+        db.session.execute(text(SEED.format(table=table, columns=columns, values=values)),
+                           params)
+    db.session.commit()
+    print(f"Seeded {args.rows} rows per table in {time.perf_counter() - start:.1f}s "
+          f"({db.engine.dialect.name})")
+
+    reports = {}
+    for revision in [BEFORE_INDEXES, 'head']:
+        # An open transaction here would hold up CREATE INDEX CONCURRENTLY.
+        db.session.commit()
+        migrate_db(revision)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        print(f"\nAt revision {revision}:")
+        reports[revision] = measure(args.rows, args.repeat, not args.quiet)
+
+    print(f"\n{'query':<20} {BEFORE_INDEXES + ' ms':>9} {'head ms':>9}  head plan")
+    failed = False
+    for name, (after_ms, full_scan) in reports['head'].items():
+        before_ms = reports[BEFORE_INDEXES][name][0]
+        failed = failed or full_scan
+        print(f"{name:<20} {before_ms:>9.3f} {after_ms:>9.3f}  "
+              f"{'FULL SCAN' if full_scan else 'index'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""Load-test the main pages against the offline Spoonacular stand-in.
+
+Starts benchmarks/fake_spoonacular.py and the app (test profile, fresh
+SQLite database) on local ports, signs up `--users` simulated users and
+has each one loop through the home page, a search, a recipe from the
+results, sometimes favoriting it, and the favorites page. Reports
+throughput, p50/p99 latency per route and Spoonacular calls per request.
+No PostgreSQL, network access or API key is needed:
+
+    python benchmarks/load_test.py --users 8 --duration 30 --latency-ms 80
+
+Exits non-zero if a threshold passed with --max-p99-ms,
+--max-api-calls-per-request or --max-error-rate is exceeded, so it can
+gate a deploy.
+"""
+
+import argparse
+import logging
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import requests  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from fake_spoonacular import FakeSpoonacular, create_fake_app  # noqa: E402
+
+QUERIES = ['chicken rice', 'pasta, garlic', 'beans', 'tomato basil', 'salmon',
+           'egg fried rice', 'tofu', 'beef stew', 'lentil soup', 'pork']
+RECIPE_LINK = re.compile(rb'href="/recipes/(\d+)"')
+
+
+def serve(wsgi_app):
+    """Serve `wsgi_app` on a free local port in a daemon thread; return its URL."""
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, wsgi_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+class Results:
+    """Latencies and failures per route, shared by the user threads."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(elapsed)
+            if not ok:
+                self.failures[route] = self.failures.get(route, 0) + 1
+
+    def total(self):
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+
+def timed(results, route, session, method, url, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, allow_redirects=False,
+                                    timeout=60, **kwargs)
+        ok = response.status_code < 400
+    except requests.RequestException:
+        response, ok = None, False
+    results.record(route, time.perf_counter() - start, ok)
+    return response
+
+
+def simulated_user(base_url, username, deadline, results, rng):
+    session = requests.Session()
+    session.post(f'{base_url}/signup', data={'username': username,
+                                             'email': f'{username}@example.com',
+                                             'password': 'loadtest'})
+    iteration = 0
+    while time.monotonic() < deadline:
+        iteration += 1
+        response = timed(results, '/', session, 'GET', f'{base_url}/')
+        recipe_ids = RECIPE_LINK.findall(response.content) if response is not None else []
+
+        response = timed(results, '/search', session, 'GET', f'{base_url}/search',
+                         params={'ingredients': rng.choice(QUERIES)})
+        if response is not None:
+            recipe_ids += RECIPE_LINK.findall(response.content)
+
+        if recipe_ids:
+            recipe_id = int(rng.choice(recipe_ids))
+            timed(results, '/recipes/<id>', session, 'GET',
+                  f'{base_url}/recipes/{recipe_id}')
+            if iteration % 3 == 0:
+                timed(results, 'POST /fav-recipes/<id>', session, 'POST',
+                      f'{base_url}/fav-recipes/{recipe_id}')
+
+        timed(results, '/fav-recipes', session, 'GET', f'{base_url}/fav-recipes')
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--latency-ms', type=float, default=80,
+                        help="injected Spoonacular latency")
+    parser.add_argument('--jitter-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="injected Spoonacular error rate")
+    parser.add_argument('--database', default='/tmp/foodiefinds-load.db')
+    parser.add_argument('--max-p99-ms', type=float)
+    parser.add_argument('--max-api-calls-per-request', type=float)
+    parser.add_argument('--max-error-rate', type=float)
+    args = parser.parse_args()
+
+    fake = FakeSpoonacular(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                           error_rate=args.error_rate, seed=0)
+    fake_url = serve(create_fake_app(fake))
+
+    if os.path.exists(args.database):
+        os.remove(args.database)
+    os.environ.update({
+        'APP_PROFILE': 'test',
+        'DATABASE_URL': f'sqlite:///{args.database}',
+        'SPOONACULAR_BASE_URL': f'{fake_url}/recipes',
+        'SPOONACULAR_API_KEY': 'load-test',
+        'SPOONACULAR_DAILY_POINTS': '1000000',
+        'SPOONACULAR_RATE_PER_SECOND': '1000',
+        'SPOONACULAR_BURST': '1000',
+    })
+    from app import create_app
+    base_url = serve(create_app('test'))
+
+    results = Results()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=simulated_user,
+                                args=(base_url, f'load{i}', deadline, results,
+                                      random.Random(i)))
+               for i in range(args.users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(f"{args.users} users, {elapsed:.1f}s, Spoonacular latency "
+          f"{args.latency_ms:.0f}±{args.jitter_ms:.0f} ms, error rate {args.error_rate}")
+    print(f"{'route':<24} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8}")
+    all_latencies = []
+    for route, latencies in results.latencies.items():
+        all_latencies += latencies
+        print(f"{route:<24} {len(latencies):>8} {results.failures.get(route, 0):>6}"
+              f" {len(latencies) / elapsed:>7.1f}"
+              f" {statistics.median(latencies) * 1000:>8.1f}"
+              f" {percentile(latencies, 0.99) * 1000:>8.1f}")
+
+    total = results.total()
+    errors = sum(results.failures.values())
+    api_calls = sum(fake.stats()['calls'].values())
+    p99_ms = percentile(all_latencies, 0.99) * 1000 if all_latencies else 0.0
+    print(f"{'all':<24} {total:>8} {errors:>6} {total / elapsed:>7.1f}"
+          f" {statistics.median(all_latencies) * 1000 if all_latencies else 0.0:>8.1f}"
+          f" {p99_ms:>8.1f}")
+    api_per_request = api_calls / total if total else 0.0
+    print(f"Spoonacular calls: {api_calls} ({api_per_request:.3f} per request) "
+          f"{fake.stats()['calls']}")
+
+    failed = []
+    if args.max_p99_ms is not None and p99_ms > args.max_p99_ms:
+        failed.append(f"p99 {p99_ms:.1f} ms > {args.max_p99_ms} ms")
+    if (args.max_api_calls_per_request is not None
+            and api_per_request > args.max_api_calls_per_request):
+        failed.append(f"{api_per_request:.3f} API calls/request > "
+                      f"{args.max_api_calls_per_request}")
+    if args.max_error_rate is not None and total and errors / total > args.max_error_rate:
+        failed.append(f"error rate {errors / total:.3f} > {args.max_error_rate}")
+    for failure in failed:
+        print(f"FAIL {failure}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Compare recipe detail preparation before and after normalize.py.
+
+"old" is what get_recipe_info used to do on every view: parse the
+instructions with BeautifulSoup and rebuild the ingredient list. "strip"
+is the new tag stripper alone, "normalize" is the once-per-fetch
+normalization stage, and "view" is what a detail view does now with a
+cached, normalized recipe. No database or API key is needed:
+
+    python benchmarks/normalize.py
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalize import normalize_recipe, strip_tags  # noqa: E402
+
+RUNS = 2000
+
+
+def synthetic_recipe(step_count=12, ingredient_count=15):
+    steps = [f'Step {i}: stir the <b>sauce</b> &amp; simmer for {i} minutes, '
+             'then season to taste.' for i in range(1, step_count + 1)]
+    return {
+        'title': 'Synthetic recipe',
+        'instructions': '<ol>' + ''.join(f'<li>{step}</li>' for step in steps) + '</ol>',
+        'extendedIngredients': [{'name': f'ingredient {i}',
+                                 'original': f'1 cup ingredient {i}, chopped'}
+                                for i in range(ingredient_count)],
+    }
+
+
+def old_view(data):
+    from bs4 import BeautifulSoup
+
+    ingredients = [ingredient['original']
+                   for ingredient in data['extendedIngredients']]
+    instructions = BeautifulSoup(data['instructions'], 'html.parser').get_text()
+    return ingredients, instructions
+
+
+def new_view(data):
+    normalized = data['normalized']
+    return normalized['ingredients'], normalized['steps']
+
+
+def time_us(fn, arg):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn(arg)
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return statistics.median(timings)
+
+
+def main():
+    data = synthetic_recipe()
+    normalized = normalize_recipe(dict(data))
+
+    rows = [('strip', time_us(strip_tags, data['instructions'])),
+            ('normalize', time_us(lambda d: normalize_recipe(dict(d)), data)),
+            ('view', time_us(new_view, normalized))]
+    try:
+        rows.insert(0, ('old', time_us(old_view, data)))
+    except ImportError:
+        print("beautifulsoup4 not installed; skipping the old path")
+
+    print(f"{'path':>10}  {'p50 us':>8}")
+    for name, p50 in rows:
+        print(f"{name:>10}  {p50:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
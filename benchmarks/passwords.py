@@ -0,0 +1,57 @@
+"""Benchmark password checks (logins) per second at different bcrypt costs.
+
+For each cost factor, times password checks from a single thread and
+from one thread per core (PasswordHasher allowing that many concurrent
+hashes), and reports logins/sec overall and per core. No database is needed:
+
+    python benchmarks/passwords.py
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher  # noqa: E402
+
+ROUNDS = [10, 11, 12]
+PASSWORD = 'correct horse battery staple'
+SECONDS = 3
+
+
+def logins_per_second(hasher, hashed, callers):
+    """Run checks from `callers` threads for SECONDS; return checks/sec."""
+
+    deadline = time.perf_counter() + SECONDS
+
+    def caller():
+        count = 0
+        while time.perf_counter() < deadline:
+            assert hasher.check(hashed, PASSWORD)
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(callers) as callers_pool:
+        total = sum(callers_pool.map(lambda _: caller(), range(callers)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores")
+    print(f"{'rounds':>6}  {'1 thread /s':>11}  {'threads /s':>10}  {'threads /s/core':>15}")
+    for rounds in ROUNDS:
+        hasher = PasswordHasher(rounds=rounds, concurrency=cores)
+        hashed = hasher.hash(PASSWORD)
+        single_rate = logins_per_second(hasher, hashed, 1)
+        threaded_rate = logins_per_second(hasher, hashed, cores)
+
+        print(f"{rounds:>6}  {single_rate:>11.1f}  {threaded_rate:>10.1f}"
+              f"  {threaded_rate / cores:>15.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark restriction filtering and ranking as the cached corpus grows.
+
+Builds synthetic corpora of increasing size and times RecipeScorer-style
+ranking for a home page draw and an ingredient search. No database or
+API key is needed:
+
+    python benchmarks/scoring.py
+"""
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from scoring import RecipeCorpus, rank_corpus  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000]
+RUNS = 20
+INGREDIENTS = ['chicken', 'rice', 'egg', 'tomato', 'onion', 'garlic', 'beef',
+               'pasta', 'cheese', 'milk', 'butter', 'flour', 'potato',
+               'carrot', 'salmon', 'shrimp', 'tofu', 'spinach', 'bean',
+               'lentil', 'pepper', 'mushroom', 'lemon', 'almond', 'peanut']
+
+
+def synthetic_corpus(size, rng):
+    ingredient_count = rng.integers(3, 12, size)
+    ingredients = [list(rng.choice(INGREDIENTS, count, replace=False))
+                   for count in ingredient_count]
+    return RecipeCorpus(
+        recipe_ids=np.arange(size),
+        titles=[f'Recipe {i}' for i in range(size)],
+        allergen_masks=rng.integers(0, 1 << 12, size),
+        diet_masks=rng.integers(0, 1 << 11, size),
+        ready_times=rng.integers(5, 180, size),
+        ingredient_tokens=ingredients)
+
+
+def time_ms(fn):
+    timings = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), max(timings)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f"{'recipes':>8}  {'build ms':>9}  {'home p50/max ms':>16}  {'search p50/max ms':>18}")
+    for size in SIZES:
+        start = time.perf_counter()
+        corpus = synthetic_corpus(size, rng)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        # Egg + peanut allergies, vegetarian diet.
+        allergy_mask, diet_mask = 0b10010, 0b100
+        home = time_ms(lambda: rank_corpus(
+            corpus, allergy_mask, diet_mask, limit=10, shuffle=True, rng=rng))
+        search = time_ms(lambda: rank_corpus(
+            corpus, allergy_mask, diet_mask, query='chicken, rice and garlic',
+            limit=50))
+
+        print(f"{size:>8}  {build_ms:>9.1f}  {home[0]:>7.2f}/{home[1]:<8.2f}"
+              f"  {search[0]:>8.2f}/{search[1]:<9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Benchmark worker boot latency for the development and production profiles.
+
+Each run starts a fresh interpreter that imports app.py and calls
+create_app(profile), which is what a gunicorn worker does at boot. The
+development profile still does what every worker used to do on import
+(debug toolbar, schema setup, seeding), so it doubles as the "before"
+number. Run against a scratch database, e.g.:
+
+    DATABASE_URL=sqlite:////tmp/foodiefinds-bench.db python benchmarks/startup.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILES = ['development', 'production']
+RUNS = 10
+
+BOOT = """
+import time
+start = time.perf_counter()
+import app
+app.create_app({profile!r})
+print((time.perf_counter() - start) * 1000)
+"""
+
+
+def boot_ms(profile):
+    output = subprocess.run(
+        [sys.executable, '-c', BOOT.format(profile=profile)],
+        cwd=ROOT, check=True, capture_output=True, text=True,
+        env={'SECRET_KEY': 'startup-benchmark', **os.environ}).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    boot_ms('development')  # migrate and seed the database once up front
+    print(f"{'profile':>12}  {'p50 ms':>8}  {'max ms':>8}")
+    for profile in PROFILES:
+        timings = [boot_ms(profile) for _ in range(RUNS)]
+        print(f"{profile:>12}  {statistics.median(timings):>8.1f}"
+              f"  {max(timings):>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
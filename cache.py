@@ -0,0 +1,508 @@
+"""Caching helpers for FoodieFinds."""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import render_template
+from markupsafe import Markup
+from sqlalchemy import delete, select, update
+
+from models import db, dialect_insert, CachedRecipe, CachedSearch
+from normalize import normalize_recipe, is_normalized
+from reference import reference_data
+from restrictions import recipe_allergens, recipe_diets
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a TTL on every entry."""
+
+    def __init__(self, max_size=512, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value stored for `key`, or None if missing/expired."""
+
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` under `key`, evicting the least recently used entry if full."""
+
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FragmentCache:
+    """Rendered template fragments keyed on the template and a content version.
+
+    `render` returns the cached Markup for (template, version) or renders
+    and stores it. With `enabled=False` every call renders.
+    """
+
+    def __init__(self, enabled=False, max_size=512, ttl=3600):
+        self.enabled = enabled
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.counters = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def render(self, template, version, **context):
+        """Render `template` with `context` unless (template, version) is cached."""
+
+        if not self.enabled:
+            return Markup(render_template(template, **context))
+
+        key = (template, version)
+        html = self.memory.get(key)
+        with self._lock:
+            self.counters['hits' if html is not None else 'misses'] += 1
+        if html is None:
+            html = Markup(render_template(template, **context))
+            self.memory.set(key, html)
+        return html
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters['enabled'] = self.enabled
+        counters['size'] = len(self.memory)
+        return counters
+
+
+class AccessTimes:
+    """Batched `accessed_at` updates for a cache table.
+
+    `touch` only records keys; they are written in one UPDATE, on a
+    connection of its own, once `interval` seconds have passed since the
+    last write.
+    """
+
+    def __init__(self, key_column, accessed_column, interval=60):
+        self.key_column = key_column
+        self.accessed_column = accessed_column
+        self.interval = interval
+        self._keys = set()
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def touch(self, keys):
+        with self._lock:
+            self._keys.update(keys)
+            due = time.monotonic() - self._flushed_at >= self.interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the pending updates now."""
+
+        with self._lock:
+            keys, self._keys = self._keys, set()
+            self._flushed_at = time.monotonic()
+        if keys:
+            with db.engine.begin() as connection:
+                connection.execute(update(self.key_column.table).where(
+                    self.key_column.in_(sorted(keys))
+                ).values({self.accessed_column: datetime.utcnow()}))
+
+
+class RecipeCache:
+    """Read-through cache for Spoonacular recipe information.
+
+    Lookups check the in-process LRU first, then the `cached_recipes` table,
+    and only call `loader(recipe_id)` when neither tier has a fresh copy.
+    `get_many` does the same for a list of ids, handing every miss to
+    `bulk_loader(recipe_ids)` in one go. Both tiers are size bounded and
+    evict the least recently used recipes.
+
+    The table is read and written on connections of its own, never through
+    the caller's `db.session`. Reads don't write: the ids they touch are
+    collected and their `accessed_at` updated in one statement at most
+    every `touch_interval` seconds. Each callable in `on_store` is called
+    with (recipe_id, data, allergen_mask, diet_mask) for every recipe
+    written, once the write has committed.
+
+    Recipes are normalized (see normalize.py) on the way in, so every
+    copy handed out carries a current `normalized` entry.
+
+    Recipes fetched by `prefetch` are marked in the table, and the first
+    `get` of one is counted as a prefetch hit (see `prefetch_stats`).
+    """
+
+    def __init__(self, loader, bulk_loader=None, ttl=86400, max_size=512,
+                 db_max_size=5000, touch_interval=60):
+        self.loader = loader
+        self.bulk_loader = bulk_loader
+        self.ttl = ttl
+        self.db_max_size = db_max_size
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+        self.on_store = []
+        self.access_times = AccessTimes(CachedRecipe.recipe_id, CachedRecipe.accessed_at,
+                                        touch_interval)
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, recipe_id):
+        """Return recipe information for `recipe_id`, fetching it if needed."""
+
+        data = self.memory.get(recipe_id)
+        if data is not None:
+            self._count('memory_hits')
+            self.access_times.touch([recipe_id])
+            return data
+
+        data = self._load_from_db(recipe_id)
+        if data is not None:
+            self._count('db_hits')
+            self.access_times.touch([recipe_id])
+            return data
+
+        self._count('misses')
+        data = self.loader(recipe_id)
+        if data is not None:
+            self.set(recipe_id, data)
+        return data
+
+    def get_many(self, recipe_ids):
+        """Return a dict of recipe id -> information for `recipe_ids`.
+
+        Ids the bulk loader could not resolve are left out of the result.
+        """
+
+        found = {}
+        missing = []
+        for recipe_id in recipe_ids:
+            data = self.memory.get(recipe_id)
+            if data is not None:
+                self._count('memory_hits')
+                found[recipe_id] = data
+            else:
+                missing.append(recipe_id)
+
+        if missing:
+            for recipe_id, data in self._load_many_from_db(missing).items():
+                self._count('db_hits')
+                found[recipe_id] = data
+            missing = [recipe_id for recipe_id in missing
+                       if recipe_id not in found]
+        self.access_times.touch(found)
+
+        if missing:
+            for recipe_id in missing:
+                self._count('misses')
+            if self.bulk_loader is None:
+                fetched = {recipe_id: self.loader(recipe_id)
+                           for recipe_id in missing}
+            else:
+                fetched = self.bulk_loader(missing)
+            fetched = {recipe_id: data for recipe_id, data in fetched.items()
+                       if data is not None}
+            self.set_many(fetched)
+            found.update(fetched)
+
+        return found
+
+    def set(self, recipe_id, data, ttl=None):
+        """Store recipe information in both tiers."""
+
+        self.set_many({recipe_id: data}, ttl=ttl)
+
+    def set_many(self, recipes, ttl=None, memory=True, prefetched=False):
+        """Store a dict of recipe id -> information in both tiers at once.
+
+        With `memory=False` only the table is written. With `prefetched`
+        the rows are marked as speculatively fetched.
+        """
+
+        if not recipes:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        for recipe_id, data in recipes.items():
+            if not is_normalized(data):
+                normalize_recipe(data)
+            if memory:
+                self.memory.set(recipe_id, data, ttl=ttl)
+
+        stored = self._store_many(recipes, ttl, prefetched)
+        for listener in self.on_store:
+            for row in stored:
+                listener(row['recipe_id'], recipes[row['recipe_id']],
+                         row['allergen_mask'], row['diet_mask'])
+
+    def prefetch(self, recipe_ids):
+        """Fetch the recipes among `recipe_ids` not cached yet, speculatively.
+
+        Returns the number of recipes fetched.
+        """
+
+        now = datetime.utcnow()
+        cached = {recipe_id for recipe_id, in db.session.query(CachedRecipe.recipe_id)
+                  .filter(CachedRecipe.recipe_id.in_(recipe_ids),
+                          CachedRecipe.expires_at > now)}
+        missing = [recipe_id for recipe_id in recipe_ids if recipe_id not in cached]
+        if not missing:
+            return 0
+
+        if self.bulk_loader is None:
+            fetched = {recipe_id: self.loader(recipe_id) for recipe_id in missing}
+        else:
+            fetched = self.bulk_loader(missing)
+        fetched = {recipe_id: data for recipe_id, data in fetched.items()
+                   if data is not None}
+        # Table only, so the first view reads the row and records the hit.
+        self.set_many(fetched, memory=False, prefetched=True)
+        return len(fetched)
+
+    def prefetch_stats(self, window=86400):
+        """Prefetched recipes and hits over the last `window` seconds."""
+
+        since = datetime.utcnow() - timedelta(seconds=window)
+        prefetched, hits = db.session.query(
+            db.func.count(CachedRecipe.prefetched_at),
+            db.func.count(CachedRecipe.prefetch_hit_at)
+        ).filter(CachedRecipe.prefetched_at >= since).one()
+        return {
+            'window_seconds': window,
+            'prefetched': prefetched,
+            'hits': hits,
+            'hit_ratio': round(hits / prefetched, 4) if prefetched else 0.0,
+        }
+
+    def stats(self):
+        """Return hit/miss counters and the hit ratio."""
+
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        hits = counters['memory_hits'] + counters['db_hits']
+        counters['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        counters['memory_size'] = len(self.memory)
+        return counters
+
+    def _store_many(self, recipes, ttl, prefetched=False):
+        """Upsert `recipes` and trim the table; returns the rows written."""
+
+        now = datetime.utcnow()
+        rows = []
+        for recipe_id, data in recipes.items():
+            row = {
+                'recipe_id': recipe_id,
+                'title': data.get('title'),
+                'data': json.dumps(data),
+                'allergen_mask': reference_data.allergy_mask(recipe_allergens(data)),
+                'diet_mask': reference_data.diet_mask(recipe_diets(data)),
+                'fetched_at': now,
+                'accessed_at': now,
+                'expires_at': now + timedelta(seconds=ttl),
+            }
+            if prefetched:
+                row.update(prefetched_at=now, prefetch_hit_at=None)
+            rows.append(row)
+
+        stmt = dialect_insert(CachedRecipe)
+        # Upserts, so a row another worker inserted first is just updated.
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CachedRecipe.recipe_id],
+            set_={name: stmt.excluded[name] for name in rows[0] if name != 'recipe_id'})
+        with db.engine.begin() as connection:
+            connection.execute(stmt, rows)
+            self._evict_db(connection)
+        return rows
+
+    def _load_from_db(self, recipe_id):
+        now = datetime.utcnow()
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(CachedRecipe.data, CachedRecipe.expires_at,
+                       CachedRecipe.prefetched_at, CachedRecipe.prefetch_hit_at)
+                .where(CachedRecipe.recipe_id == recipe_id,
+                       CachedRecipe.expires_at > now)).first()
+        if row is None:
+            return None
+
+        if row.prefetched_at is not None and row.prefetch_hit_at is None:
+            with db.engine.begin() as connection:
+                connection.execute(update(CachedRecipe).where(
+                    CachedRecipe.recipe_id == recipe_id,
+                    CachedRecipe.prefetch_hit_at.is_(None)
+                ).values(prefetch_hit_at=now))
+        data = self._row_data(recipe_id, row.data)
+
+        remaining = (row.expires_at - now).total_seconds()
+        self.memory.set(recipe_id, data, ttl=remaining)
+        return data
+
+    def _load_many_from_db(self, recipe_ids):
+        now = datetime.utcnow()
+        with db.engine.connect() as connection:
+            rows = connection.execute(
+                select(CachedRecipe.recipe_id, CachedRecipe.data, CachedRecipe.expires_at)
+                .where(CachedRecipe.recipe_id.in_(recipe_ids),
+                       CachedRecipe.expires_at > now)).all()
+
+        found = {}
+        for row in rows:
+            data = self._row_data(row.recipe_id, row.data)
+            remaining = (row.expires_at - now).total_seconds()
+            self.memory.set(row.recipe_id, data, ttl=remaining)
+            found[row.recipe_id] = data
+        return found
+
+    def _row_data(self, recipe_id, raw):
+        """Decode a cached row, normalizing copies stored before normalize.py."""
+
+        data = json.loads(raw)
+        if not is_normalized(data):
+            normalize_recipe(data)
+            with db.engine.begin() as connection:
+                connection.execute(update(CachedRecipe).where(
+                    CachedRecipe.recipe_id == recipe_id).values(data=json.dumps(data)))
+        return data
+
+    def _evict_db(self, connection):
+        """Trim the persistent tier down to `db_max_size` rows."""
+
+        count = connection.execute(select(db.func.count()).select_from(CachedRecipe)).scalar()
+        if count <= self.db_max_size:
+            return
+
+        stale = (select(CachedRecipe.recipe_id)
+                 .order_by(CachedRecipe.accessed_at)
+                 .limit(count - self.db_max_size)
+                 .subquery())
+        connection.execute(delete(CachedRecipe).where(
+            CachedRecipe.recipe_id.in_(select(stale.c.recipe_id))))
+
+
+def search_key(query, allergies, diets):
+    """Canonical cache key for a search.
+
+    Query terms are lowercased, split on commas and whitespace, deduplicated
+    and sorted, so "Chicken, rice" and "rice chicken" share a key.
+    """
+
+    terms = sorted(set(query.lower().replace(',', ' ').split()))
+    return '|'.join([' '.join(terms), ','.join(sorted(allergies)),
+                     ','.join(sorted(diets))])
+
+
+class SearchCache:
+    """Read-through cache for recipe search results.
+
+    `loader(query, allergies, diets)` returns the full result list for a
+    normalized query; it is only called when neither the in-process LRU nor
+    the `cached_searches` table has a fresh entry for the key. Lists are
+    stored whole so later pages are sliced locally. Like RecipeCache, the
+    table is used on connections of its own and reads batch their
+    `accessed_at` updates.
+    """
+
+    def __init__(self, loader, ttl=3600, max_size=256, db_max_size=2000,
+                 touch_interval=60):
+        self.loader = loader
+        self.ttl = ttl
+        self.db_max_size = db_max_size
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+        self.access_times = AccessTimes(CachedSearch.key, CachedSearch.accessed_at,
+                                        touch_interval)
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, query, allergies, diets):
+        """Return the cached result list for a search, fetching it if needed."""
+
+        key = search_key(query, allergies, diets)
+        results = self.memory.get(key)
+        if results is not None:
+            self._count('memory_hits')
+            self.access_times.touch([key])
+            return results
+
+        now = datetime.utcnow()
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(CachedSearch.results, CachedSearch.expires_at)
+                .where(CachedSearch.key == key, CachedSearch.expires_at > now)).first()
+        if row is not None:
+            self._count('db_hits')
+            self.access_times.touch([key])
+            results = json.loads(row.results)
+            self.memory.set(key, results,
+                            ttl=(row.expires_at - now).total_seconds())
+            return results
+
+        self._count('misses')
+        results = self.loader(key.split('|')[0], allergies, diets)
+        self._store(key, results)
+        return results
+
+    def stats(self):
+        """Return hit/miss counters and the hit ratio."""
+
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        hits = counters['memory_hits'] + counters['db_hits']
+        counters['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        counters['memory_size'] = len(self.memory)
+        return counters
+
+    def _store(self, key, results):
+        self.memory.set(key, results)
+
+        now = datetime.utcnow()
+        stmt = dialect_insert(CachedSearch).values(
+            key=key, results=json.dumps(results), accessed_at=now,
+            expires_at=now + timedelta(seconds=self.ttl))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CachedSearch.key],
+            set_={'results': stmt.excluded.results,
+                  'accessed_at': stmt.excluded.accessed_at,
+                  'expires_at': stmt.excluded.expires_at})
+        with db.engine.begin() as connection:
+            connection.execute(stmt)
+            count = connection.execute(
+                select(db.func.count()).select_from(CachedSearch)).scalar()
+            if count > self.db_max_size:
+                stale = (select(CachedSearch.key)
+                         .order_by(CachedSearch.accessed_at)
+                         .limit(count - self.db_max_size)
+                         .subquery())
+                connection.execute(delete(CachedSearch).where(
+                    CachedSearch.key.in_(select(stale.c.key))))
@@ -0,0 +1,190 @@
+"""Home page feed pools for FoodieFinds.
+
+Instead of a random complexSearch on every home page view, recipes are
+fetched in bulk into a pool per distinct (intolerances, diets) combination
+and each view draws a random handful from it.
+"""
+
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, FeedPool
+
+
+def pool_key(allergies, diets):
+    """Canonical key for a set of allergies and diets."""
+
+    return '|'.join([','.join(sorted(allergies)), ','.join(sorted(diets))])
+
+
+class FeedPools:
+    """Draws home page recipes from shared, pre-filled pools.
+
+    `search(allergies, diets, number)` fetches `number` random recipes for a
+    restriction set and returns them as [{"name", "id"}]. Each process keeps
+    a copy of the pools it serves and re-reads a pool's row at most every
+    `reload_interval` seconds, so a view normally touches the database not
+    at all. A pool is refilled once it is older than `max_age` seconds, has
+    served `max_draws` views from this process, or holds fewer than
+    `draw_size` recipes. The refill is claimed on the row first
+    (`refill_started_at`), so only one process starts it; that claim is the
+    only write a view makes.
+
+    With a jobs.JobQueue as `queue`, claimed refills are queued as
+    `fill_feed_pool` jobs for worker.py instead of running on a thread.
+    """
+
+    def __init__(self, search, pool_size=100, draw_size=10, max_age=21600,
+                 max_draws=200, refill_timeout=300, reload_interval=60,
+                 queue=None):
+        self.search = search
+        self.queue = queue
+        self.pool_size = pool_size
+        self.draw_size = draw_size
+        self.max_age = max_age
+        self.max_draws = max_draws
+        self.refill_timeout = refill_timeout
+        self.reload_interval = reload_interval
+        # key -> {'recipes', 'filled_at', 'draws', 'claimed_at', 'loaded_at'}
+        self.pools = {}
+        self._lock = threading.Lock()
+
+    def draw(self, allergies, diets):
+        """Return `draw_size` random recipes for the given restrictions.
+
+        The first view for a new combination fills its pool inline, so
+        errors from `search` (including quota.QuotaExceeded) propagate.
+        """
+
+        key = pool_key(allergies, diets)
+        pool = self._local(key)
+        if pool is None:
+            row = db.session.get(FeedPool, key) or self.fill(allergies, diets)
+            pool = self._keep(row)
+
+        with self._lock:
+            pool['draws'] += 1
+            due = self._needs_refill(pool['filled_at'], pool['recipes'], pool['draws'])
+        if due:
+            self.refill_in_background(allergies, diets)
+
+        recipes = pool['recipes']
+        return random.sample(recipes, min(self.draw_size, len(recipes)))
+
+    def fill(self, allergies, diets):
+        """Fetch a fresh pool for the given restrictions and store it."""
+
+        key = pool_key(allergies, diets)
+        recipes = self.search(allergies, diets, self.pool_size)
+        now = datetime.utcnow()
+
+        pool = db.session.get(FeedPool, key)
+        if pool is None:
+            pool = FeedPool(key=key)
+            db.session.add(pool)
+        pool.recipes = json.dumps(recipes)
+        pool.filled_at = now
+        pool.refill_started_at = None
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker filled the same pool first; use theirs.
+            db.session.rollback()
+            pool = db.session.get(FeedPool, key)
+        self._keep(pool)
+        return pool
+
+    def refill_in_background(self, allergies, diets):
+        """Refill a pool off the request unless another worker already is."""
+
+        key = pool_key(allergies, diets)
+        if not self._claim_refill(key):
+            return
+
+        if self.queue is not None:
+            self.queue.enqueue('fill_feed_pool',
+                               {'allergies': list(allergies), 'diets': list(diets)},
+                               dedup_key=f'feed:{key}')
+            return
+
+        app = current_app._get_current_object()
+
+        def refill():
+            with app.app_context():
+                try:
+                    self.fill(allergies, diets)
+                except Exception:
+                    app.logger.exception("Feed pool refill failed")
+
+        threading.Thread(target=refill, daemon=True).start()
+
+    def warm(self, limit=10):
+        """Refill up to `limit` pools that are due by age or size, oldest first."""
+
+        pools = FeedPool.query.order_by(FeedPool.filled_at).all()
+        due = [pool.key for pool in pools
+               if self._needs_refill(pool.filled_at, json.loads(pool.recipes))][:limit]
+        for key in due:
+            allergies, diets = (part.split(',') if part else []
+                                for part in key.split('|'))
+            self.fill(allergies, diets)
+        return len(due)
+
+    def _local(self, key):
+        """This process's copy of a pool, or None if it's missing or due a reload."""
+
+        with self._lock:
+            pool = self.pools.get(key)
+        if pool is None or time.monotonic() - pool['loaded_at'] > self.reload_interval:
+            return None
+        return pool
+
+    def _keep(self, row):
+        """Store a copy of `row`, keeping the draw count and claim if it wasn't refilled."""
+
+        with self._lock:
+            previous = self.pools.get(row.key)
+            pool = {'recipes': json.loads(row.recipes), 'filled_at': row.filled_at,
+                    'draws': 0, 'claimed_at': None, 'loaded_at': time.monotonic()}
+            if previous is not None and previous['filled_at'] == row.filled_at:
+                pool['draws'] = previous['draws']
+                pool['claimed_at'] = previous['claimed_at']
+            self.pools[row.key] = pool
+        return pool
+
+    def _needs_refill(self, filled_at, recipes, draws=0):
+        age = (datetime.utcnow() - filled_at).total_seconds()
+        return (age > self.max_age or draws >= self.max_draws
+                or len(recipes) < self.draw_size)
+
+    def _claim_refill(self, key):
+        """Mark a pool as being refilled; False if someone else holds it.
+
+        Also False while this process's own claim is outstanding, so a due
+        pool doesn't cost every view an UPDATE.
+        """
+
+        now = datetime.utcnow()
+        with self._lock:
+            pool = self.pools.get(key)
+            if pool is not None:
+                claimed_at = pool['claimed_at']
+                if (claimed_at is not None
+                        and time.monotonic() - claimed_at < self.refill_timeout):
+                    return False
+                pool['claimed_at'] = time.monotonic()
+
+        expired = now - timedelta(seconds=self.refill_timeout)
+        claimed = FeedPool.query.filter(
+            FeedPool.key == key,
+            db.or_(FeedPool.refill_started_at.is_(None),
+                   FeedPool.refill_started_at < expired)
+        ).update({FeedPool.refill_started_at: now}, synchronize_session=False)
+        db.session.commit()
+        return claimed == 1
@@ -2,7 +2,7 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, SelectField, SelectMultipleField
 from wtforms.validators import DataRequired, Email, Length, Optional, URL
 from wtforms.widgets import ListWidget, CheckboxInput
-from models import Allergy, DietaryPreference
+from reference import reference_data
 
 
 class AddUserForm(FlaskForm):
@@ -18,14 +18,18 @@ class EditForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = StringField('E-mail', validators=[DataRequired(), Email()])
 
+    # The checked boxes are the user's full set of allergies/diets; ids
+    # are coerced to int to match the choices.
     allergies = SelectMultipleField(
         'Allergies',
+        coerce=int,
         widget=ListWidget(prefix_label=False),  # Render as a list
         option_widget=CheckboxInput(),  # Render options as checkboxes
     )
-    
+
     diet_prefs = SelectMultipleField(
         'Dietary Preferences',
+        coerce=int,
         widget=ListWidget(prefix_label=False),  # Render as a list
         option_widget=CheckboxInput(),  # Render options as checkboxes
     )
@@ -33,13 +37,11 @@ class EditForm(FlaskForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Populate the allergy choices from the database
-        self.allergies.choices = [(None, 'Add Allergy')] + [(allergy.id, allergy.type)
-                                                            for allergy in Allergy.query.all()]
+        # Populate the allergy choices from the reference data
+        self.allergies.choices = reference_data.allergies()
 
-        # Populate the diet preferences choices from the database
-        self.diet_prefs.choices = [(None, 'Add Dietary Preference')] + [(diet.id, diet.type)
-                                                                        for diet in DietaryPreference.query.all()]
+        # Populate the diet preferences choices from the reference data
+        self.diet_prefs.choices = reference_data.diets()
 
 
 class LoginForm(FlaskForm):
@@ -0,0 +1,76 @@
+"""HTTP caching helpers for FoodieFinds: ETags, 304s and Cache-Control.
+
+Pages are rendered per user, so ETags mix the content version with
+everything user-specific the templates show, and responses are `private`
+with `Vary: Cookie` so shared caches never serve one user's page to
+another.
+"""
+
+import hashlib
+import json
+import os
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+
+def content_etag(*parts):
+    """Strong ETag value for a list of JSON-serializable parts."""
+
+    raw = json.dumps(parts, sort_keys=True, default=str).encode('UTF-8')
+    return hashlib.sha256(raw).hexdigest()[:32]
+
+
+def template_version(app):
+    """Hash of every template file, so ETags change when templates do."""
+
+    digest = hashlib.sha256()
+    root = os.path.join(app.root_path, app.template_folder)
+    for dirpath, _, filenames in sorted(os.walk(root)):
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(path, root).encode('UTF-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def not_modified(etag):
+    """A 304 response if the client already holds `etag`, else None.
+
+    Never matches while flashed messages are pending, since the cached
+    page wouldn't show them.
+    """
+
+    if (request.method not in ('GET', 'HEAD') or '_flashes' in session
+            or not request.if_none_match.contains(etag)):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
+def with_etag(response, etag):
+    """Attach `etag` to a response (or anything make_response accepts)."""
+
+    response = make_response(response)
+    response.set_etag(etag)
+    return response
+
+
+def cache_control(config_key):
+    """Set the Cache-Control header from app.config[config_key] on 200/304s.
+
+    Other responses (redirects, errors) are left alone.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.headers['Cache-Control'] = current_app.config[config_key]
+                response.vary.add('Cookie')
+            return response
+        return wrapped
+    return decorator
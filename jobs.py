@@ -0,0 +1,174 @@
+"""Database-backed job queue for FoodieFinds.
+
+Web workers `enqueue` jobs into the `jobs` table and worker.py runs them,
+so network fetches and cache refreshes happen outside the request cycle.
+Jobs with a `dedup_key` are only queued once until they finish, failed
+jobs are retried with exponential backoff, and `stats` reports the queue
+depth for /api-stats.
+"""
+
+import json
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Job
+
+
+class JobQueue:
+    """Queue of named jobs with registered handlers.
+
+    Handlers are registered with `task(kind)` and called with the job
+    payload as keyword arguments. A job that raises is retried after
+    `retry_delay * 2 ** (attempts - 1)` seconds, up to `max_attempts`
+    times, after which it stays in the table as `failed`. Running jobs
+    whose worker died are picked up again after `lock_timeout` seconds.
+    """
+
+    def __init__(self, max_attempts=5, retry_delay=30, lock_timeout=300):
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lock_timeout = lock_timeout
+        self.handlers = {}
+
+    def task(self, kind):
+        """Register the decorated function as the handler for `kind`."""
+
+        def register(fn):
+            self.handlers[kind] = fn
+            return fn
+        return register
+
+    def enqueue(self, kind, payload=None, dedup_key=None, delay=0):
+        """Queue a job; returns False if `dedup_key` is already queued."""
+
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind {kind!r}")
+
+        if dedup_key is not None and Job.query.filter_by(dedup_key=dedup_key).first():
+            return False
+
+        now = datetime.utcnow()
+        db.session.add(Job(kind=kind, payload=json.dumps(payload or {}),
+                           dedup_key=dedup_key, status='queued', attempts=0,
+                           run_at=now + timedelta(seconds=delay), created_at=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker queued the same key first.
+            db.session.rollback()
+            return False
+        return True
+
+    def cancel(self, dedup_key):
+        """Drop a queued (not yet running) job; returns True if one was."""
+
+        cancelled = Job.query.filter_by(
+            dedup_key=dedup_key, status='queued'
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return cancelled > 0
+
+    def claim(self):
+        """Mark the next due job as running and return it, or None."""
+
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=self.lock_timeout)
+        due = db.or_(db.and_(Job.status == 'queued', Job.run_at <= now),
+                     db.and_(Job.status == 'running', Job.locked_at < expired))
+
+        while True:
+            job = (Job.query.filter(due).order_by(Job.run_at)
+                   .with_for_update(skip_locked=True).first())
+            if job is None:
+                db.session.commit()
+                return None
+
+            # The status/attempts check makes the claim safe on SQLite too,
+            # where FOR UPDATE SKIP LOCKED is a no-op.
+            claimed = Job.query.filter(
+                Job.id == job.id, Job.status == job.status,
+                Job.attempts == job.attempts
+            ).update({Job.status: 'running', Job.locked_at: now,
+                      Job.attempts: Job.attempts + 1},
+                     synchronize_session=False)
+            db.session.commit()
+            if claimed == 1:
+                db.session.refresh(job)
+                return job
+
+    def run_one(self):
+        """Claim and run one job; returns False if nothing was due."""
+
+        job = self.claim()
+        if job is None:
+            return False
+
+        job_id, kind, attempts = job.id, job.kind, job.attempts
+        try:
+            self.handlers[kind](**json.loads(job.payload))
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception("Job %s (%s) failed", job_id, kind)
+            self._fail(job_id, attempts, traceback.format_exc())
+        else:
+            Job.query.filter_by(id=job_id).delete()
+            db.session.commit()
+        return True
+
+    def run(self, poll_interval=1.0, periodic=None, stop=None):
+        """Run jobs until `stop()` is true, sleeping when the queue is empty.
+
+        `periodic` maps job kinds to intervals in seconds; each is queued
+        (deduplicated on its kind) at most once per interval, so several
+        workers can share one schedule.
+        """
+
+        app = current_app._get_current_object()
+        next_due = {kind: 0 for kind in periodic or {}}
+
+        while not (stop and stop()):
+            with app.app_context():
+                for kind, interval in (periodic or {}).items():
+                    if time.monotonic() >= next_due[kind]:
+                        self.enqueue(kind, dedup_key=f'periodic:{kind}')
+                        next_due[kind] = time.monotonic() + interval
+                ran = self.run_one()
+            if not ran:
+                time.sleep(poll_interval)
+
+    def stats(self):
+        """Queue depth by status and kind, and the age of the oldest due job."""
+
+        by_status = dict(db.session.query(Job.status, db.func.count())
+                         .group_by(Job.status).all())
+        queued = dict(db.session.query(Job.kind, db.func.count())
+                      .filter(Job.status == 'queued')
+                      .group_by(Job.kind).all())
+        now = datetime.utcnow()
+        oldest = (db.session.query(db.func.min(Job.run_at))
+                  .filter(Job.status == 'queued', Job.run_at <= now).scalar())
+        return {
+            'queued': by_status.get('queued', 0),
+            'running': by_status.get('running', 0),
+            'failed': by_status.get('failed', 0),
+            'queued_by_kind': queued,
+            'oldest_due_seconds': (round((now - oldest).total_seconds(), 1)
+                                   if oldest else 0.0),
+        }
+
+    def _fail(self, job_id, attempts, error):
+        if attempts >= self.max_attempts:
+            # Give up, and free the dedup key so the work can be queued again.
+            values = {Job.status: 'failed', Job.dedup_key: None}
+        else:
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            values = {Job.status: 'queued',
+                      Job.run_at: datetime.utcnow() + timedelta(seconds=delay)}
+        values[Job.locked_at] = None
+        values[Job.last_error] = error[-4000:]
+        Job.query.filter_by(id=job_id).update(values, synchronize_session=False)
+        db.session.commit()
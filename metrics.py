@@ -0,0 +1,275 @@
+"""Request instrumentation and a Prometheus /metrics endpoint for FoodieFinds.
+
+Collects per-route latency, SQL statement counts and time per request,
+Jinja render time and Spoonacular call latency into in-process counters
+and histograms, and renders them in the Prometheus text format. Values
+are per process: scrape each gunicorn worker, or run one.
+
+With PROFILER_TOKEN set, a request carrying `X-Profile: <token>` is
+sampled by a stack sampler while it runs and the folded stacks (the
+input format for flamegraph.pl / speedscope) are written to PROFILER_DIR.
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from datetime import datetime
+
+from flask import Response, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _label_text(pairs):
+    pairs = list(pairs)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_label_text(zip(self.labelnames, labels))} {value}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: (list(buckets), count, total)
+                      for labels, (buckets, count, total) in self.values.items()}
+        for labels, (buckets, count, total) in sorted(values.items()):
+            pairs = list(zip(self.labelnames, labels))
+            for bound, bucket_count in zip(self.buckets, buckets):
+                yield f'{self.name}_bucket{_label_text(pairs + [("le", bound)])} {bucket_count}'
+            yield f'{self.name}_bucket{_label_text(pairs + [("le", "+Inf")])} {count}'
+            yield f'{self.name}_count{_label_text(pairs)} {count}'
+            yield f'{self.name}_sum{_label_text(pairs)} {round(total, 6)}'
+
+
+class Metrics:
+    """Registry of the app's metrics plus the Flask/SQLAlchemy hooks feeding it.
+
+    `add_gauges(fn)` registers a callable returning (name, help, labels
+    dict, value) tuples, evaluated on every scrape; it's how cache hit
+    ratios are exposed without the caches knowing about this module.
+    """
+
+    def __init__(self):
+        self.requests = Histogram(
+            'foodiefinds_request_seconds', 'Request latency by route.',
+            ('route', 'method', 'status'))
+        self.request_sql_statements = Histogram(
+            'foodiefinds_request_sql_statements', 'SQL statements per request.',
+            ('route',), buckets=COUNT_BUCKETS)
+        self.request_sql_seconds = Histogram(
+            'foodiefinds_request_sql_seconds', 'SQL time per request.', ('route',))
+        self.sql_statements = Counter(
+            'foodiefinds_sql_statements_total', 'SQL statements executed.')
+        self.sql_seconds = Counter(
+            'foodiefinds_sql_seconds_total', 'Time spent in SQL statements.')
+        self.render_seconds = Histogram(
+            'foodiefinds_template_render_seconds', 'Jinja render time by template.',
+            ('template',))
+        self.api_seconds = Histogram(
+            'foodiefinds_spoonacular_seconds', 'Spoonacular call latency by endpoint.',
+            ('endpoint', 'outcome'))
+        self.profiles = Counter(
+            'foodiefinds_profiles_total', 'Requests run under the sampling profiler.')
+        self.collectors = [self.requests, self.request_sql_statements,
+                           self.request_sql_seconds, self.sql_statements,
+                           self.sql_seconds, self.render_seconds,
+                           self.api_seconds, self.profiles]
+        self.gauge_sources = []
+
+    def init_app(self, app):
+        """Install the request, render and SQL hooks and the /metrics route."""
+
+        self.app = app
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        event.listen(Engine, 'before_cursor_execute', self._before_sql)
+        event.listen(Engine, 'after_cursor_execute', self._after_sql)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+
+    def add_gauges(self, source):
+        self.gauge_sources.append(source)
+        return source
+
+    def observe_api(self, endpoint, elapsed, ok):
+        """SpoonacularClient observer: record one call's latency."""
+
+        self.api_seconds.observe(elapsed, endpoint, 'ok' if ok else 'error')
+
+    def render(self):
+        """The /metrics view: every metric in the Prometheus text format."""
+
+        lines = []
+        for metric in self.collectors:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+
+        gauges = {}
+        for source in self.gauge_sources:
+            for name, help, labels, value in source():
+                gauges.setdefault(name, (help, []))[1].append((labels, value))
+        for name, (help, samples) in sorted(gauges.items()):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                lines.append(f'{name}{_label_text(labels.items())} {value}')
+
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+
+        token = self.app.config.get('PROFILER_TOKEN')
+        if token and hmac.compare_digest(request.headers.get('X-Profile', ''), token):
+            g.profiler = StackSampler(threading.get_ident(),
+                                      self.app.config['PROFILER_INTERVAL'])
+            g.profiler.start()
+
+    def _after_request(self, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.requests.observe(time.perf_counter() - start, route,
+                              request.method, response.status_code)
+        self.request_sql_statements.observe(g.sql_statements, route)
+        self.request_sql_seconds.observe(g.sql_seconds, route)
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            self.profiles.inc()
+            path = profiler.save(self.app.config['PROFILER_DIR'], route)
+            response.headers['X-Profile-File'] = path
+        return response
+
+    def _before_render(self, app, template, context):
+        if has_request_context():
+            g.setdefault('render_starts', []).append(time.perf_counter())
+
+    def _after_render(self, app, template, context):
+        starts = g.get('render_starts') if has_request_context() else None
+        if starts:
+            self.render_seconds.observe(time.perf_counter() - starts.pop(),
+                                        template.name or 'string')
+
+    def _before_sql(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_starts', []).append(time.perf_counter())
+
+    def _after_sql(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('metrics_starts')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        self.sql_statements.inc()
+        self.sql_seconds.inc(amount=elapsed)
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements += 1
+            g.sql_seconds += elapsed
+
+
+class StackSampler:
+    """Samples one thread's stack every `interval` seconds on a side thread."""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def save(self, directory, label):
+        """Write the folded stacks to a new file in `directory`; return its path."""
+
+        os.makedirs(directory, exist_ok=True)
+        name = label.strip('/').replace('/', '_').replace('<', '').replace('>', '') or 'root'
+        path = os.path.join(
+            directory, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{name}.folded")
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}'
+                             f':{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+
+metrics = Metrics()
@@ -0,0 +1,53 @@
+"""Alembic environment for FoodieFinds.
+
+Migrates the database the Flask app is configured for. `flask --app app
+init-db` runs this inside the app context; the `alembic` command line
+imports app.py and pushes a context itself.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+from flask import has_app_context
+
+from models import db
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+
+def run_migrations(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=db.metadata,
+        # SQLite (the test profile) can't ALTER most things in place;
+        # batch mode rebuilds the table instead. No-op elsewhere.
+        render_as_batch=connection.dialect.name == 'sqlite',
+        compare_type=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations(connection)
+        return
+
+    with db.engine.connect() as connection:
+        run_migrations(connection)
+
+
+if context.is_offline_mode():
+    raise SystemExit("Offline (--sql) migrations aren't supported; "
+                     "run against a database instead.")
+
+if has_app_context():
+    run_migrations_online()
+else:
+    from app import app
+
+    with app.app_context():
+        run_migrations_online()
@@ -0,0 +1,80 @@
+"""Baseline schema
+
+The tables as `db.create_all()` made them before any of the caching and
+restriction mask changes. Databases created that way are stamped at this
+revision by `init-db` instead of running it, then upgraded by the rest.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 14:07:33.757482
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('username', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'))
+    op.create_table(
+        'allergies',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('type', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_table(
+        'diet_prefs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('type', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'))
+    op.create_table(
+        'fav_recipes',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('recipe_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'recipe_id'))
+    op.create_table(
+        'user_allergies',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('allergy_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['allergy_id'], ['allergies.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'allergy_id'))
+    op.create_table(
+        'user_diet_prefs',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('diet_prefs_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['diet_prefs_id'], ['diet_prefs.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('user_id', 'diet_prefs_id'))
+    op.create_table(
+        'user_recipes',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('title', sa.Text(), nullable=False),
+        sa.Column('photo_url', sa.Text(), nullable=True),
+        sa.Column('ingredients', sa.Text(), nullable=False),
+        sa.Column('instructions', sa.Text(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'))
+
+
+def downgrade():
+    op.drop_table('user_recipes')
+    op.drop_table('user_diet_prefs')
+    op.drop_table('user_allergies')
+    op.drop_table('fav_recipes')
+    op.drop_table('diet_prefs')
+    op.drop_table('allergies')
+    op.drop_table('users')
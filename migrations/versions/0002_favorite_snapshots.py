@@ -0,0 +1,39 @@
+"""Favorite recipe snapshots
+
+Stores the title, image, ready time and ingredient summary of each
+favorite so /fav-recipes can render without calling Spoonacular.
+Existing favorites start with no snapshot. The page shows them as "N/A"
+and queues a refresh_favorite_snapshots job, which fills them in once
+worker.py runs it.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 14:08:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('fav_recipes') as batch_op:
+        batch_op.add_column(sa.Column('title', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('image', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('ready_in_minutes', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('ingredient_summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('snapshot_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('fav_recipes') as batch_op:
+        batch_op.drop_column('snapshot_at')
+        batch_op.drop_column('ingredient_summary')
+        batch_op.drop_column('ready_in_minutes')
+        batch_op.drop_column('image')
+        batch_op.drop_column('title')
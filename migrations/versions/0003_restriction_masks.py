@@ -0,0 +1,47 @@
+"""Restriction masks on users
+
+Adds users.allergy_mask and users.diet_mask, bitmasks of the user's
+allergy and diet ids, and fills them in from user_allergies and
+user_diet_prefs. Left at 0, an existing user's allergies would be ignored
+by recipe filtering.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:09:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# Bit (id - 1) per row, as reference.restriction_bit; the primary keys make
+# each (user, id) pair unique, so the sum is the bitwise OR.
+BACKFILL = """
+UPDATE users SET {column} = COALESCE((
+    SELECT SUM(CAST(1 AS BIGINT) << ({table}.{id_column} - 1)) FROM {table}
+    WHERE {table}.user_id = users.id), 0)
+"""
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('allergy_mask', sa.BigInteger(),
+                                      server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('diet_mask', sa.BigInteger(),
+                                      server_default='0', nullable=False))
+
+    op.execute(BACKFILL.format(column='allergy_mask', table='user_allergies',
+                               id_column='allergy_id'))
+    op.execute(BACKFILL.format(column='diet_mask', table='user_diet_prefs',
+                               id_column='diet_prefs_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('diet_mask')
+        batch_op.drop_column('allergy_mask')
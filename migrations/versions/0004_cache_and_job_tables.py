@@ -0,0 +1,85 @@
+"""Cache, quota, feed pool and job tables
+
+The persistent recipe and search caches, the shared Spoonacular quota,
+the home page feed pools and the background job queue.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 14:10:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'cached_recipes',
+        sa.Column('recipe_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('title', sa.Text(), nullable=True),
+        sa.Column('data', sa.Text(), nullable=False),
+        sa.Column('allergen_mask', sa.BigInteger(), nullable=False),
+        sa.Column('diet_mask', sa.BigInteger(), nullable=False),
+        sa.Column('fetched_at', sa.DateTime(), nullable=False),
+        sa.Column('accessed_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('prefetched_at', sa.DateTime(), nullable=True),
+        sa.Column('prefetch_hit_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('recipe_id'))
+    op.create_index('ix_cached_recipes_accessed_at', 'cached_recipes', ['accessed_at'])
+    op.create_index('ix_cached_recipes_prefetched_at', 'cached_recipes', ['prefetched_at'])
+    op.create_table(
+        'cached_searches',
+        sa.Column('key', sa.Text(), nullable=False),
+        sa.Column('results', sa.Text(), nullable=False),
+        sa.Column('accessed_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key'))
+    op.create_index('ix_cached_searches_accessed_at', 'cached_searches', ['accessed_at'])
+    op.create_table(
+        'api_quota',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('points_used', sa.Float(), nullable=False),
+        sa.Column('points_left', sa.Float(), nullable=True),
+        sa.Column('requests', sa.Integer(), nullable=False),
+        sa.Column('rejected', sa.Integer(), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('refilled_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('day'))
+    op.create_table(
+        'feed_pools',
+        sa.Column('key', sa.Text(), nullable=False),
+        sa.Column('recipes', sa.Text(), nullable=False),
+        sa.Column('filled_at', sa.DateTime(), nullable=False),
+        sa.Column('refill_started_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('key'))
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('kind', sa.Text(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('dedup_key', sa.Text(), nullable=True),
+        sa.Column('status', sa.Text(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('dedup_key'))
+    op.create_index('ix_jobs_run_at', 'jobs', ['run_at'])
+
+
+def downgrade():
+    op.drop_table('jobs')
+    op.drop_table('feed_pools')
+    op.drop_table('api_quota')
+    op.drop_table('cached_searches')
+    op.drop_table('cached_recipes')
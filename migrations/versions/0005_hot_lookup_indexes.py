@@ -0,0 +1,39 @@
+"""Indexes for per-user lookups
+
+user_recipes had no index on user_id, so /user-recipes and deleting a
+user scanned the table. The association tables get reverse indexes for
+lookups and foreign key checks from the allergy/diet side. users.username
+(unique) and fav_recipes (user_id, recipe_id) were already indexed by
+their constraints.
+
+The indexes are built CONCURRENTLY on PostgreSQL so writes to the tables
+aren't blocked while they build.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 14:20:00.000000
+"""
+
+from alembic import op
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_recipes_user_id_id', 'user_recipes', ['user_id', 'id'],
+                        postgresql_include=['title'], postgresql_concurrently=True)
+        op.create_index('ix_user_allergies_allergy_id', 'user_allergies',
+                        ['allergy_id', 'user_id'], postgresql_concurrently=True)
+        op.create_index('ix_user_diet_prefs_diet_prefs_id', 'user_diet_prefs',
+                        ['diet_prefs_id', 'user_id'], postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_diet_prefs_diet_prefs_id', table_name='user_diet_prefs')
+    op.drop_index('ix_user_allergies_allergy_id', table_name='user_allergies')
+    op.drop_index('ix_user_recipes_user_id_id', table_name='user_recipes')
@@ -0,0 +1,40 @@
+"""Server-side sessions
+
+Adds session_records, which holds session data and cached user context
+snapshots, and users.context_version, which versions those snapshots.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 14:14:37.259454
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'session_records',
+        sa.Column('key', sa.Text(), nullable=False),
+        sa.Column('data', sa.Text(), nullable=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('key'))
+    op.create_index('ix_session_records_expires_at', 'session_records', ['expires_at'])
+
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('context_version', sa.Integer(),
+                                      server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('context_version')
+
+    op.drop_table('session_records')
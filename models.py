@@ -1,9 +1,15 @@
 """Models for FoodieFinds."""
 
-from flask_bcrypt import Bcrypt
+from datetime import datetime
+
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
+
+from passwords import hasher
+from reference import reference_data, restriction_bit
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
@@ -14,6 +20,27 @@ def connect_db(app):
     db.init_app(app)
 
 
+def dialect_insert(model):
+    """INSERT into `model`'s table with the ON CONFLICT clauses available.
+
+    PostgreSQL and SQLite both support ON CONFLICT; this picks the
+    statement class for whichever the app is running on.
+    """
+
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    return dialect.insert(model)
+
+
+def insert_ignoring_conflicts(model):
+    """INSERT into `model`'s table that skips rows whose key already exists.
+
+    A duplicate is a no-op rather than an IntegrityError that rolls back
+    the whole transaction.
+    """
+
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
 class User(db.Model):
     """User Model"""
 
@@ -26,6 +53,15 @@ class User(db.Model):
                          nullable=False, unique=True)
     email = db.Column(db.String, nullable=False)
     password = db.Column(db.String, nullable=False)
+    # Bitmasks of the user's allergy/diet ids, kept in step with the
+    # user_allergies/user_diet_prefs rows by _sync_restriction_masks.
+    allergy_mask = db.Column(db.BigInteger, nullable=False, default=0,
+                             server_default='0')
+    diet_mask = db.Column(db.BigInteger, nullable=False, default=0,
+                          server_default='0')
+    # Bumped whenever the cached user context (sessions.py) goes stale.
+    context_version = db.Column(db.Integer, nullable=False, default=0,
+                                server_default='0')
 
     fav_recipes = db.relationship(
         'FavoriteRecipe', cascade="all, delete-orphan")
@@ -41,9 +77,24 @@ class User(db.Model):
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @classmethod
+    def load_context(cls, user_id):
+        """Load a user with favorite recipe ids eagerly.
+
+        Takes a fixed number of queries however many restrictions the user
+        has: allergies and diets are read from the restriction masks and
+        `reference_data`, and favorite ids (used for the heart icons in
+        templates) come in with one selectin query that skips the snapshot
+        columns.
+        """
+
+        return cls.query.options(
+            selectinload(cls.fav_recipes).load_only(FavoriteRecipe.recipe_id),
+        ).filter_by(id=user_id).first()
+
     def get_allergies(self):
         """Retrieve the allergies for this user."""
-        allergies = [ua.allergy.type for ua in self.allergies]
+        allergies = reference_data.allergy_types(self.allergy_mask or 0)
         return allergies
 
     def has_allergy(self, allergy_id):
@@ -52,26 +103,60 @@ class User(db.Model):
         :param allergy_id: The ID of the allergy to check.
         :return: True if the user has the allergy, False otherwise.
         """
-        for user_allergy in self.allergies:
-            if user_allergy.allergy_id == allergy_id:
-                return True
-        return False
+        if allergy_id is None:
+            return False
+        return bool((self.allergy_mask or 0) & restriction_bit(allergy_id))
 
     def get_diet(self):
         """Retrieve the dietary preferences for this user."""
-        diets = [ud.diet_pref.type for ud in self.diet_prefs]
+        diets = reference_data.diet_types(self.diet_mask or 0)
         return diets
 
     def has_diet(self, diet_id):
         """
-        Check if the user has a specific allergy.
-        :param allergy_id: The ID of the allergy to check.
-        :return: True if the user has the allergy, False otherwise.
+        Check if the user has a specific dietary preference.
+        :param diet_id: The ID of the dietary preference to check.
+        :return: True if the user has the diet, False otherwise.
         """
-        for user_diet_pref in self.diet_prefs:
-            if user_diet_pref.diet_prefs_id == diet_id:
-                return True
-        return False
+        if diet_id is None:
+            return False
+        return bool((self.diet_mask or 0) & restriction_bit(diet_id))
+
+    def set_restrictions(self, allergy_ids, diet_ids):
+        """Replace the user's allergies and diets with the given ids.
+
+        Diffs against the masks rather than walking the relationships, and
+        writes each changed kind with one DELETE of the ids no longer
+        wanted and one INSERT ... ON CONFLICT DO NOTHING of the wanted
+        ones, after the masks are flushed. The users row update comes
+        first, so concurrent edits of the same user queue behind its row
+        lock and the last one wins for both rows and masks. Runs in the
+        caller's transaction; the caller commits.
+        """
+
+        kinds = [(UserAllergy, UserAllergy.allergy_id, 'allergy_mask', set(allergy_ids)),
+                 (UserDiet, UserDiet.diet_prefs_id, 'diet_mask', set(diet_ids))]
+        changed = []
+        for model, column, attr, wanted in kinds:
+            mask = 0
+            for restriction_id in wanted:
+                mask |= restriction_bit(restriction_id)
+            if mask != (getattr(self, attr) or 0):
+                setattr(self, attr, mask)
+                changed.append((model, column, wanted))
+        if not changed:
+            return False
+
+        db.session.flush()
+        for model, column, wanted in changed:
+            model.query.filter(model.user_id == self.id, column.not_in(wanted)).delete(
+                synchronize_session=False)
+            if wanted:
+                db.session.execute(insert_ignoring_conflicts(model).values(
+                    [{'user_id': self.id, column.key: restriction_id}
+                     for restriction_id in sorted(wanted)]))
+        db.session.expire(self, ['allergies', 'diet_prefs'])
+        return True
 
     @classmethod
     def signup(cls, username, email, password):
@@ -80,7 +165,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -95,13 +180,18 @@ class User(db.Model):
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different cost factor than the
+        configured one, it is replaced; the caller commits.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -124,19 +214,70 @@ class Allergy(db.Model):
 
 
 class FavoriteRecipe(db.Model):
-    """Favorite Recipes Model for User"""
+    """Favorite Recipes Model for User
+
+    Keeps a snapshot of the recipe's title, image, ready time and
+    ingredients so favorites can be listed without calling the API.
+    """
 
     __tablename__ = "fav_recipes"
 
     user_id = db.Column(db.Integer, db.ForeignKey(
         'users.id'), primary_key=True)
     recipe_id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.Text)
+    image = db.Column(db.Text)
+    ready_in_minutes = db.Column(db.Integer)
+    ingredient_summary = db.Column(db.Text)
+    snapshot_at = db.Column(db.DateTime)
+
+    @staticmethod
+    def snapshot_values(data):
+        """The listing fields from Spoonacular recipe information."""
+
+        return {
+            'title': data.get('title'),
+            'image': data.get('image'),
+            'ready_in_minutes': data.get('readyInMinutes'),
+            'ingredient_summary': ', '.join(
+                ingredient['name'] for ingredient in data.get('extendedIngredients', [])),
+            'snapshot_at': datetime.utcnow(),
+        }
+
+    @classmethod
+    def add(cls, user_id, data):
+        """Favorite the recipe in `data` for the user, if it isn't already.
+
+        A single INSERT ... ON CONFLICT DO NOTHING, so a double submit or
+        two tabs favoriting at once can't fail. Returns whether a row was
+        added; the caller commits.
+        """
+
+        result = db.session.execute(insert_ignoring_conflicts(cls).values(
+            user_id=user_id, recipe_id=data['id'], **cls.snapshot_values(data)))
+        return result.rowcount == 1
+
+    def update_snapshot(self, data):
+        """Copy the listing fields out of Spoonacular recipe information."""
+
+        for name, value in self.snapshot_values(data).items():
+            setattr(self, name, value)
+
+    def is_stale(self, max_age):
+        """Check if the snapshot is missing or older than `max_age` seconds."""
+
+        if self.snapshot_at is None:
+            return True
+        return (datetime.utcnow() - self.snapshot_at).total_seconds() > max_age
 
 
 class UserAllergy(db.Model):
     """User-Allergy Association Table"""
 
     __tablename__ = "user_allergies"
+    # The primary key covers lookups by user; this one covers the reverse
+    # side (and the foreign key check when an allergy row is deleted).
+    __table_args__ = (db.Index('ix_user_allergies_allergy_id', 'allergy_id', 'user_id'),)
 
     user_id = db.Column(db.Integer, db.ForeignKey(
         "users.id"), primary_key=True)
@@ -152,6 +293,8 @@ class UserDiet(db.Model):
     """User-Diet Association Table"""
 
     __tablename__ = "user_diet_prefs"
+    __table_args__ = (
+        db.Index('ix_user_diet_prefs_diet_prefs_id', 'diet_prefs_id', 'user_id'),)
 
     user_id = db.Column(db.Integer, db.ForeignKey(
         "users.id"), primary_key=True)
@@ -168,6 +311,10 @@ class UserRecipe(db.Model):
     """User-added Recipe Table"""
 
     __tablename__ = "user_recipes"
+    # Covers the /user-recipes page (user_id = ? AND id > ? ORDER BY id),
+    # title included so PostgreSQL can answer it with an index-only scan.
+    __table_args__ = (db.Index('ix_user_recipes_user_id_id', 'user_id', 'id',
+                               postgresql_include=['title']),)
 
     id = db.Column(db.Integer,
                    primary_key=True,
@@ -177,3 +324,111 @@ class UserRecipe(db.Model):
     ingredients = db.Column(db.Text, nullable=False)
     instructions = db.Column(db.Text, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+
+
+class CachedRecipe(db.Model):
+    """Persistent tier of the Spoonacular recipe-information cache"""
+
+    __tablename__ = "cached_recipes"
+
+    recipe_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.Text)
+    data = db.Column(db.Text, nullable=False)
+    allergen_mask = db.Column(db.BigInteger, nullable=False, default=0)
+    diet_mask = db.Column(db.BigInteger, nullable=False, default=0)
+    fetched_at = db.Column(db.DateTime, nullable=False)
+    accessed_at = db.Column(db.DateTime, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    # Set when a speculative prefetch cached the row, and on its first view.
+    prefetched_at = db.Column(db.DateTime, nullable=True, index=True)
+    prefetch_hit_at = db.Column(db.DateTime, nullable=True)
+
+
+class ApiQuota(db.Model):
+    """Spoonacular quota usage for one UTC day, shared by every worker"""
+
+    __tablename__ = "api_quota"
+
+    day = db.Column(db.Date, primary_key=True)
+    points_used = db.Column(db.Float, nullable=False, default=0)
+    points_left = db.Column(db.Float, nullable=True)
+    requests = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    tokens = db.Column(db.Float, nullable=False)
+    refilled_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+
+class FeedPool(db.Model):
+    """Pre-fetched home page recipes shared by users with the same restrictions"""
+
+    __tablename__ = "feed_pools"
+
+    key = db.Column(db.Text, primary_key=True)
+    recipes = db.Column(db.Text, nullable=False)
+    filled_at = db.Column(db.DateTime, nullable=False)
+    refill_started_at = db.Column(db.DateTime, nullable=True)
+
+
+class CachedSearch(db.Model):
+    """Persistent tier of the recipe search cache, keyed on a normalized query"""
+
+    __tablename__ = "cached_searches"
+
+    key = db.Column(db.Text, primary_key=True)
+    results = db.Column(db.Text, nullable=False)
+    accessed_at = db.Column(db.DateTime, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class SessionRecord(db.Model):
+    """Server-side session data and user context snapshots (see sessions.py)"""
+
+    __tablename__ = "session_records"
+
+    key = db.Column(db.Text, primary_key=True)
+    # JSON; NULL marks a user context invalidated at `version`.
+    data = db.Column(db.Text, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Job(db.Model):
+    """Background work for worker.py, queued by the web workers"""
+
+    __tablename__ = "jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    # Set while queued or running so the same work isn't queued twice.
+    dedup_key = db.Column(db.Text, unique=True, nullable=True)
+    status = db.Column(db.Text, nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, index=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+@event.listens_for(Session, "before_flush")
+def _sync_restriction_masks(session, flush_context, instances):
+    """Apply pending user_allergies/user_diet_prefs changes to the user masks."""
+
+    changes = [(obj, True) for obj in session.new]
+    changes += [(obj, False) for obj in session.deleted]
+
+    with session.no_autoflush:
+        for obj, added in changes:
+            if isinstance(obj, UserAllergy):
+                attr, bit = 'allergy_mask', restriction_bit(obj.allergy_id)
+            elif isinstance(obj, UserDiet):
+                attr, bit = 'diet_mask', restriction_bit(obj.diet_prefs_id)
+            else:
+                continue
+
+            user = session.get(User, obj.user_id)
+            if user is None or user in session.deleted:
+                continue
+            mask = getattr(user, attr) or 0
+            setattr(user, attr, mask | bit if added else mask & ~bit)
@@ -0,0 +1,73 @@
+"""Normalize Spoonacular recipe information for display.
+
+Runs once when a recipe enters the recipe cache. The result is stored
+with the recipe under `normalized`, so the detail view renders plain
+steps and ingredient lines without parsing any HTML.
+"""
+
+import hashlib
+import html
+import json
+import re
+
+# Bump when the normalized shape changes; older cached copies are redone.
+VERSION = 2
+
+_BLOCK_TAG = re.compile(r'<\s*(?:br|/?p|/?li|/?ol|/?ul|/?div|/?h\d)\b[^>]*>',
+                        re.IGNORECASE)
+_TAG = re.compile(r'<[^>]*>')
+_SPACES = re.compile(r'[ \t\r\f\v]+')
+
+
+def strip_tags(markup):
+    """Plain text of an HTML fragment, one line per block element."""
+
+    if not markup:
+        return ''
+    text = _TAG.sub('', _BLOCK_TAG.sub('\n', markup))
+    lines = (_SPACES.sub(' ', line).strip()
+             for line in html.unescape(text).split('\n'))
+    return '\n'.join(line for line in lines if line)
+
+
+def instruction_steps(data):
+    """Ordered instruction steps for a recipe.
+
+    Uses Spoonacular's `analyzedInstructions` when present, and otherwise
+    splits the `instructions` HTML on its block elements.
+    """
+
+    steps = [step['step'].strip()
+             for section in data.get('analyzedInstructions') or []
+             for step in section.get('steps', [])
+             if step.get('step')]
+    if steps:
+        return steps
+    text = strip_tags(data.get('instructions'))
+    return text.split('\n') if text else []
+
+
+def content_hash(data):
+    """Hex digest of recipe information, ignoring the `normalized` entry."""
+
+    raw = {key: value for key, value in data.items() if key != 'normalized'}
+    return hashlib.sha256(json.dumps(raw, sort_keys=True).encode('UTF-8')).hexdigest()
+
+
+def normalize_recipe(data):
+    """Add a `normalized` entry to recipe information and return it."""
+
+    data['normalized'] = {
+        'version': VERSION,
+        'content_hash': content_hash(data),
+        'ingredients': [ingredient.get('original') or ingredient.get('name') or ''
+                        for ingredient in data.get('extendedIngredients') or []],
+        'steps': instruction_steps(data),
+    }
+    return data
+
+
+def is_normalized(data):
+    """Check if `data` carries a normalized entry of the current version."""
+
+    return (data.get('normalized') or {}).get('version') == VERSION
@@ -0,0 +1,82 @@
+"""Password hashing for FoodieFinds.
+
+bcrypt is pure CPU work. It releases the GIL, so it runs on the request
+thread and several threads can hash at once, but at most
+PASSWORD_HASH_CONCURRENCY hashes run at a time in a process. A caller that
+gets no slot within PASSWORD_HASH_TIMEOUT seconds gets HashingBusy rather
+than piling up behind a burst of logins.
+
+This only keeps other routes responsive with threaded workers
+(`gunicorn --threads N`) and PASSWORD_HASH_CONCURRENCY below N, so some
+threads are always left for requests that don't hash. A sync worker
+serves one request at a time: the limit never comes into play and a
+login holds the whole worker.
+"""
+
+import threading
+
+import bcrypt
+
+
+class HashingBusy(Exception):
+    """Raised when every hashing slot stays taken for the whole timeout."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+def hash_rounds(hashed):
+    """The cost factor a bcrypt hash was made with, e.g. 12 for $2b$12$..."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """bcrypt hashing with a tunable cost factor and a cap on concurrent hashes."""
+
+    def __init__(self, rounds=12, concurrency=4, timeout=10):
+        self.rounds = rounds
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(concurrency)
+
+    def init_app(self, app):
+        """Read BCRYPT_LOG_ROUNDS and the PASSWORD_HASH_* settings."""
+
+        self.rounds = app.config.get('BCRYPT_LOG_ROUNDS', self.rounds)
+        self.concurrency = app.config.get(
+            'PASSWORD_HASH_CONCURRENCY', self.concurrency)
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', self.timeout)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+
+    def hash(self, password):
+        """Hash `password` with the configured cost factor."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Check `password` against a stored hash."""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Check if a stored hash was made with a different cost factor."""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise HashingBusy("Password hashing is saturated.")
+        try:
+            return fn(*args)
+        finally:
+            self._slots.release()
+
+
+hasher = PasswordHasher()
@@ -0,0 +1,152 @@
+"""Spoonacular quota tracking and rate limiting for FoodieFinds.
+
+State lives in the `api_quota` table so every gunicorn worker draws from
+the same token bucket and daily points budget.
+"""
+
+import time
+from datetime import datetime
+
+import requests
+from sqlalchemy import select, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, ApiQuota
+
+
+class QuotaExceeded(requests.RequestException):
+    """Raised instead of calling Spoonacular when the budget is spent."""
+
+
+class QuotaLimiter:
+    """Token bucket plus daily points budget for the Spoonacular key.
+
+    `rate` tokens are added per second up to `burst`; every call spends one
+    token and its estimated point cost. Callers wait up to `max_wait`
+    seconds for a token before QuotaExceeded is raised. Spoonacular's
+    X-API-Quota-* headers replace the estimates once a call returns.
+    """
+
+    def __init__(self, daily_points=150, rate=1.0, burst=5, max_wait=2.0):
+        self.daily_points = daily_points
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.table = ApiQuota.__table__
+
+    def acquire(self, points=1):
+        """Reserve a token and `points` of today's budget for one call."""
+
+        now = datetime.utcnow()
+        with db.engine.begin() as conn:
+            row = self._lock_today(conn, now)
+            tokens = min(self.burst, row.tokens +
+                         (now - row.refilled_at).total_seconds() * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+
+            reason = None
+            if row.points_used + points > self.daily_points:
+                reason = "Daily Spoonacular quota reached."
+            elif row.points_left is not None and row.points_left < points:
+                reason = "Daily Spoonacular quota reached."
+            elif wait > self.max_wait:
+                reason = "Spoonacular rate limit reached."
+
+            if reason:
+                conn.execute(update(self.table)
+                             .where(self.table.c.day == row.day)
+                             .values(rejected=row.rejected + 1))
+            else:
+                conn.execute(update(self.table)
+                             .where(self.table.c.day == row.day)
+                             .values(tokens=tokens - 1,
+                                     refilled_at=now,
+                                     points_used=row.points_used + points,
+                                     requests=row.requests + 1,
+                                     updated_at=now))
+
+        if reason:
+            raise QuotaExceeded(reason)
+        if wait:
+            time.sleep(wait)
+
+    def record(self, headers):
+        """Update today's usage from Spoonacular's quota headers."""
+
+        used = headers.get('X-API-Quota-Used')
+        left = headers.get('X-API-Quota-Left')
+        if used is None and left is None:
+            return
+
+        values = {'updated_at': datetime.utcnow()}
+        if used is not None:
+            values['points_used'] = float(used)
+        if left is not None:
+            values['points_left'] = float(left)
+
+        with db.engine.begin() as conn:
+            row = self._lock_today(conn, values['updated_at'])
+            conn.execute(update(self.table)
+                         .where(self.table.c.day == row.day)
+                         .values(**values))
+
+    def points_left(self):
+        """Points still available today, by our count or Spoonacular's."""
+
+        row = self._today(datetime.utcnow())
+        if row is None:
+            return self.daily_points
+        points_left = self.daily_points - row.points_used
+        if row.points_left is not None:
+            points_left = min(points_left, row.points_left)
+        return max(points_left, 0)
+
+    def stats(self):
+        """Return today's usage and burn rate."""
+
+        now = datetime.utcnow()
+        row = self._today(now)
+        points_used = row.points_used if row else 0
+        hours = max((now - datetime.combine(now.date(), datetime.min.time()))
+                    .total_seconds() / 3600, 1 / 60)
+        burn_rate = points_used / hours
+        points_left = self.daily_points - points_used
+        if row and row.points_left is not None:
+            points_left = min(points_left, row.points_left)
+
+        return {
+            'day': now.date().isoformat(),
+            'daily_points': self.daily_points,
+            'points_used': round(points_used, 2),
+            'points_left': round(max(points_left, 0), 2),
+            'requests': row.requests if row else 0,
+            'rejected': row.rejected if row else 0,
+            'burn_rate_per_hour': round(burn_rate, 2),
+            'hours_until_exhausted': (round(points_left / burn_rate, 2)
+                                      if burn_rate and points_left > 0 else None),
+        }
+
+    def _today(self, now):
+        return db.session.execute(
+            select(self.table).where(self.table.c.day == now.date())).first()
+
+    def _lock_today(self, conn, now):
+        """Return today's row locked for update, creating it if needed."""
+
+        query = (select(self.table)
+                 .where(self.table.c.day == now.date())
+                 .with_for_update())
+        row = conn.execute(query).first()
+        if row is not None:
+            return row
+
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(self.table).values(
+                    day=now.date(), points_used=0, requests=0, rejected=0,
+                    tokens=self.burst, refilled_at=now, updated_at=now))
+        except IntegrityError:
+            # Another worker created today's row first.
+            pass
+        return conn.execute(query).first()
+
@@ -0,0 +1,129 @@
+"""Process-local lookup tables for the allergy and diet seed data.
+
+Allergies and diets are also represented as integer bitmasks, with bit
+`id - 1` standing for the row with that id, so restriction checks over
+many recipes are single bitwise operations.
+"""
+
+import threading
+
+from sqlalchemy import event
+
+
+def restriction_bit(restriction_id):
+    """Mask bit for an allergy or diet id."""
+
+    return 1 << (restriction_id - 1)
+
+
+class ReferenceData:
+    """Maps allergy and diet ids to types and back.
+
+    The tables are loaded from the database once and kept until
+    `invalidate` is called, which `watch` arranges for whenever a row in
+    `allergies` or `diet_prefs` is written through the ORM.
+    """
+
+    def __init__(self):
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """(Re)load both lookup tables from the database."""
+
+        from models import db, Allergy, DietaryPreference
+
+        # This can run lazily in the middle of a unit of work (e.g. while a
+        # cache row is half filled in), so don't flush it.
+        with db.session.no_autoflush:
+            allergies = [(allergy.id, allergy.type)
+                         for allergy in Allergy.query.order_by(Allergy.id)]
+            diets = [(diet.id, diet.type)
+                     for diet in DietaryPreference.query.order_by(DietaryPreference.id)]
+        tables = {
+            'allergies': allergies,
+            'diets': diets,
+            'allergy_types': dict(allergies),
+            'allergy_ids': {type_: id_ for id_, type_ in allergies},
+            'diet_types': dict(diets),
+            'diet_ids': {type_: id_ for id_, type_ in diets},
+        }
+        with self._lock:
+            self._tables = tables
+        return tables
+
+    def invalidate(self, *args):
+        with self._lock:
+            self._tables = None
+
+    def watch(self):
+        """Invalidate the tables whenever the seed data is written."""
+
+        from models import Allergy, DietaryPreference
+
+        for model in (Allergy, DietaryPreference):
+            for name in ('after_insert', 'after_update', 'after_delete'):
+                event.listen(model, name, self.invalidate)
+
+    def allergies(self):
+        """All allergies as (id, type) pairs, in id order."""
+
+        return self._get()['allergies']
+
+    def diets(self):
+        """All dietary preferences as (id, type) pairs, in id order."""
+
+        return self._get()['diets']
+
+    def allergy_type(self, allergy_id):
+        return self._get()['allergy_types'].get(allergy_id)
+
+    def allergy_id(self, allergy_type):
+        return self._get()['allergy_ids'].get(allergy_type)
+
+    def diet_type(self, diet_id):
+        return self._get()['diet_types'].get(diet_id)
+
+    def diet_id(self, diet_type):
+        return self._get()['diet_ids'].get(diet_type)
+
+    def allergy_mask(self, allergy_types):
+        """Bitmask of the given allergy types; unknown types are ignored."""
+
+        ids = self._get()['allergy_ids']
+        return _mask(ids.get(type_) for type_ in allergy_types)
+
+    def diet_mask(self, diet_types):
+        """Bitmask of the given diet types; unknown types are ignored."""
+
+        ids = self._get()['diet_ids']
+        return _mask(ids.get(type_) for type_ in diet_types)
+
+    def allergy_types(self, mask):
+        """Allergy types set in `mask`, in id order."""
+
+        return [type_ for id_, type_ in self.allergies()
+                if mask & restriction_bit(id_)]
+
+    def diet_types(self, mask):
+        """Diet types set in `mask`, in id order."""
+
+        return [type_ for id_, type_ in self.diets()
+                if mask & restriction_bit(id_)]
+
+    def _get(self):
+        tables = self._tables
+        if tables is None:
+            tables = self.load()
+        return tables
+
+
+def _mask(restriction_ids):
+    mask = 0
+    for restriction_id in restriction_ids:
+        if restriction_id is not None:
+            mask |= restriction_bit(restriction_id)
+    return mask
+
+
+reference_data = ReferenceData()
@@ -0,0 +1,142 @@
+"""Match Spoonacular recipe information against allergies and diets.
+
+Types are the ones seeded into the `allergies` and `diet_prefs` tables.
+Spoonacular only flags some of them directly, so allergens it doesn't
+flag are detected from ingredient names. Keywords match whole words
+(plurals folded), so "egg" matches "eggs" but not "eggplant"; compound
+ingredient names that contain an allergen are listed as keywords of
+their own.
+"""
+
+import re
+
+ALLERGEN_KEYWORDS = {
+    'Dairy': ('milk', 'buttermilk', 'cheese', 'butter', 'cream', 'yogurt',
+              'whey', 'ghee', 'casein', 'parmesan', 'mozzarella', 'ricotta'),
+    'Egg': ('egg', 'mayonnaise', 'mayo', 'meringue'),
+    'Gluten': ('wheat', 'flour', 'barley', 'rye', 'bread', 'pasta', 'noodle',
+               'couscous', 'seitan', 'soy sauce', 'breadcrumb', 'tortilla'),
+    'Grain': ('wheat', 'flour', 'barley', 'rye', 'rice', 'oat', 'oatmeal',
+              'corn', 'cornmeal', 'cornstarch', 'cornflour', 'popcorn',
+              'quinoa', 'millet', 'bread', 'pasta', 'noodle', 'couscous',
+              'tortilla'),
+    'Peanut': ('peanut',),
+    'Seafood': ('fish', 'catfish', 'swordfish', 'monkfish', 'whitefish',
+                'salmon', 'tuna', 'cod', 'anchovy', 'sardine', 'tilapia',
+                'halibut', 'trout', 'shellfish', 'shrimp', 'prawn', 'crab',
+                'crabmeat', 'lobster', 'clam', 'mussel', 'oyster', 'scallop',
+                'squid'),
+    'Sesame': ('sesame', 'tahini'),
+    'Shellfish': ('shellfish', 'shrimp', 'prawn', 'crab', 'crabmeat', 'lobster',
+                  'clam', 'mussel', 'oyster', 'scallop', 'crawfish'),
+    'Soy': ('soy', 'soybean', 'tofu', 'edamame', 'tempeh', 'miso'),
+    'Sulfite': ('wine', 'vinegar', 'dried', 'molasses', 'sulfite'),
+    'Tree Nut': ('almond', 'cashew', 'walnut', 'pecan', 'pistachio',
+                 'hazelnut', 'macadamia', 'brazil nut', 'pine nut'),
+    'Wheat': ('wheat', 'flour', 'bread', 'pasta', 'noodle', 'couscous',
+              'semolina', 'seitan', 'breadcrumb', 'tortilla'),
+}
+
+# Allergens Spoonacular reports with a boolean "free" flag.
+ALLERGEN_FREE_FLAGS = {'Dairy': 'dairyFree', 'Gluten': 'glutenFree'}
+
+# Diet types mapped to the names Spoonacular uses in `diets`.
+DIET_NAMES = {
+    'Gluten Free': ('gluten free',),
+    'Ketogenic': ('ketogenic',),
+    'Vegetarian': ('vegetarian', 'lacto ovo vegetarian', 'vegan'),
+    'Lacto-Vegetarian': ('lacto vegetarian', 'lacto ovo vegetarian', 'vegan'),
+    'Ovo-Vegetarian': ('ovo vegetarian', 'lacto ovo vegetarian', 'vegan'),
+    'Vegan': ('vegan',),
+    'Pescetarian': ('pescatarian', 'pescetarian'),
+    'Paleo': ('paleo', 'paleolithic'),
+    'Primal': ('primal',),
+    'Low FODMAP': ('fodmap friendly', 'low fodmap'),
+    'Whole 30': ('whole 30',),
+}
+
+# Diets Spoonacular also reports with a boolean flag.
+DIET_FLAGS = {'Gluten Free': 'glutenFree', 'Vegetarian': 'vegetarian',
+              'Vegan': 'vegan'}
+
+
+def fold_plural(word):
+    """Singular form of a lowercase word, e.g. "eggs" -> "egg", "anchovies" -> "anchovy"."""
+
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('oes') and len(word) > 4:
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def words(text):
+    """Lowercase words of `text` with plurals folded."""
+
+    return [fold_plural(word) for word in re.findall(r'[a-z]+', text.lower())]
+
+
+# Keywords as word tuples, folded the same way as the names they're matched to.
+ALLERGEN_PHRASES = {allergy: [tuple(words(keyword)) for keyword in keywords]
+                    for allergy, keywords in ALLERGEN_KEYWORDS.items()}
+
+
+def ingredient_names(data):
+    """Lowercased ingredient names from recipe information."""
+
+    return [(ingredient.get('name') or ingredient.get('original') or '').lower()
+            for ingredient in data.get('extendedIngredients', [])]
+
+
+def recipe_allergens(data):
+    """Return the set of allergy types a recipe may contain."""
+
+    found = text_allergens(ingredient_names(data))
+    for allergy, flag in ALLERGEN_FREE_FLAGS.items():
+        if data.get(flag):
+            found.discard(allergy)
+    return found
+
+
+def text_allergens(names):
+    """Return the allergy types with a keyword among the words of any of `names`."""
+
+    found = set()
+    for name in names:
+        name_words = words(name)
+        for allergy, phrases in ALLERGEN_PHRASES.items():
+            if allergy not in found and any(_has_phrase(name_words, phrase)
+                                            for phrase in phrases):
+                found.add(allergy)
+    return found
+
+
+def _has_phrase(name_words, phrase):
+    size = len(phrase)
+    return any(tuple(name_words[start:start + size]) == phrase
+               for start in range(len(name_words) - size + 1))
+
+
+def recipe_diets(data):
+    """Return the set of diet types a recipe satisfies."""
+
+    spoonacular_diets = {diet.lower() for diet in data.get('diets', [])}
+    found = set()
+    for diet, names in DIET_NAMES.items():
+        flag = DIET_FLAGS.get(diet)
+        if (flag and data.get(flag)) or spoonacular_diets.intersection(names):
+            found.add(diet)
+    return found
+
+
+def mask_fits(allergen_mask, diet_mask, user_allergy_mask, user_diet_mask):
+    """Check a recipe's masks against a user's.
+
+    A recipe is safe if it shares no allergen bit with the user and has
+    every diet bit the user has.
+    """
+
+    return (not allergen_mask & user_allergy_mask
+            and diet_mask & user_diet_mask == user_diet_mask)
@@ -0,0 +1,164 @@
+"""Vectorized restriction filtering and ranking over cached recipes.
+
+Used to serve the home page and search from local data once the
+Spoonacular quota is spent. The cached corpus is held as NumPy arrays so
+filtering and ranking 100k recipes is a handful of array operations.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from search_index import INGREDIENT_WEIGHT, tokenize
+
+# Ingredient coverage outweighs everything else; ready time breaks ties.
+COVERAGE_WEIGHT = 10.0
+READY_TIME_SCALE = 30.0
+
+
+class RecipeCorpus:
+    """Column arrays for a set of recipes, plus ingredient postings.
+
+    `ingredient_tokens` holds each recipe's ingredient terms, as produced
+    by search_index.tokenize.
+    """
+
+    def __init__(self, recipe_ids, titles, allergen_masks, diet_masks,
+                 ready_times, ingredient_tokens):
+        self.ids = np.asarray(recipe_ids, dtype=np.int64)
+        self.titles = list(titles)
+        self.allergen_masks = np.asarray(allergen_masks, dtype=np.int64)
+        self.diet_masks = np.asarray(diet_masks, dtype=np.int64)
+        ready = np.asarray(ready_times, dtype=np.float32)
+        # Unknown ready times rank as slow rather than fast.
+        ready[~np.isfinite(ready)] = 240
+        self.quickness = 1.0 / (1.0 + ready / READY_TIME_SCALE)
+
+        postings = {}
+        for row, tokens in enumerate(ingredient_tokens):
+            for token in set(tokens):
+                postings.setdefault(token, []).append(row)
+        self.postings = {token: np.asarray(rows, dtype=np.int32)
+                         for token, rows in postings.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class RecipeScorer:
+    """Ranks restriction-compatible recipes from the local cache.
+
+    The corpus is derived from `index` (a search_index.RecipeIndex), which
+    has already decoded and tokenized every cached recipe. It is built on
+    first use and rebuilt on a background thread, while the old one keeps
+    serving, whenever the index is rebuilt, or once the index has changed
+    and the corpus is older than `max_age` seconds.
+    """
+
+    def __init__(self, index, max_age=300):
+        self.index = index
+        self.max_age = max_age
+        self.corpus = None
+        self.built_at = None
+        self.index_version = None
+        self.index_built_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def load(self):
+        """(Re)build the corpus from the search index's Spoonacular recipes."""
+
+        version, built_at = self.index.version, self.index.built_at
+        recipe_ids, titles, allergen_masks, diet_masks = [], [], [], []
+        ready_times, ingredient_tokens = [], []
+        for recipe_id, doc in self.index.spoonacular_docs():
+            recipe_ids.append(recipe_id)
+            titles.append(doc['name'])
+            allergen_masks.append(doc['allergen_mask'])
+            diet_masks.append(doc['diet_mask'])
+            ready_times.append(doc['ready_minutes'] or np.nan)
+            ingredient_tokens.append([token for token, weight in doc['tokens'].items()
+                                      if weight == INGREDIENT_WEIGHT])
+
+        corpus = RecipeCorpus(recipe_ids, titles, allergen_masks, diet_masks,
+                              ready_times, ingredient_tokens)
+        with self._lock:
+            self.corpus = corpus
+            self.built_at = time.monotonic()
+            self.index_version = version
+            self.index_built_at = built_at
+        return corpus
+
+    def rank(self, allergy_mask, diet_mask, query=None, limit=10,
+             shuffle=False, rng=None):
+        """Return up to `limit` compatible recipes as [{"name", "id"}].
+
+        With a `query`, only recipes sharing at least one ingredient term
+        are returned, ranked by the share of query terms they cover and
+        then by how quick they are. With `shuffle`, recipes are drawn at
+        random with a bias towards quick ones, for the home page.
+        """
+
+        corpus = self._fresh_corpus()
+        return rank_corpus(corpus, allergy_mask, diet_mask, query=query,
+                           limit=limit, shuffle=shuffle, rng=rng)
+
+    def _fresh_corpus(self):
+        self.index.refresh_in_background()
+        if self.corpus is None:
+            return self.load()
+        if (self.index.built_at != self.index_built_at
+                or (self.index.version != self.index_version
+                    and time.monotonic() - self.built_at > self.max_age)):
+            self._load_in_background()
+        return self.corpus
+
+    def _load_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def load():
+            try:
+                self.load()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=load, daemon=True).start()
+
+
+def rank_corpus(corpus, allergy_mask, diet_mask, query=None, limit=10,
+                shuffle=False, rng=None):
+    """Filter and rank `corpus` for one user; see RecipeScorer.rank."""
+
+    if not len(corpus):
+        return []
+
+    ok = ((corpus.allergen_masks & allergy_mask) == 0)
+    ok &= (corpus.diet_masks & diet_mask) == diet_mask
+    score = corpus.quickness.copy()
+
+    terms = set(tokenize(query)) if query else set()
+    if terms:
+        matches = np.zeros(len(corpus), dtype=np.int16)
+        for term in terms:
+            rows = corpus.postings.get(term)
+            if rows is not None:
+                matches[rows] += 1
+        ok &= matches > 0
+        score += COVERAGE_WEIGHT * matches / len(terms)
+
+    if shuffle:
+        rng = rng or np.random.default_rng()
+        score += rng.random(len(corpus), dtype=np.float32) * 2
+
+    candidates = np.flatnonzero(ok)
+    if len(candidates) > limit:
+        top = np.argpartition(-score[candidates], limit)[:limit]
+        candidates = candidates[top]
+    ordered = candidates[np.argsort(-score[candidates], kind='stable')]
+
+    return [{"name": corpus.titles[row], "id": int(corpus.ids[row])}
+            for row in ordered]
@@ -0,0 +1,268 @@
+"""Local full-text recipe search for FoodieFinds.
+
+An in-process inverted index over user-added recipes and every recipe in
+the Spoonacular cache, so /search can answer from local data before it
+spends API quota.
+"""
+
+import json
+import re
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, attributes
+
+from models import CachedRecipe, UserRecipe
+from reference import reference_data
+from restrictions import fold_plural, ingredient_names, mask_fits, text_allergens
+
+STOP_WORDS = {'a', 'an', 'and', 'of', 'or', 'the', 'to', 'with', 'in', 'for',
+              'on', 'cup', 'cups', 'tbsp', 'tsp', 'oz', 'lb', 'g'}
+
+# Field weights; ingredient matches rank above title and instruction matches.
+INGREDIENT_WEIGHT = 3
+TITLE_WEIGHT = 2
+TEXT_WEIGHT = 1
+
+# UserRecipe columns the index is built from; other updates don't touch it.
+CONTENT_FIELDS = ('user_id', 'title', 'ingredients', 'instructions')
+
+
+def tokenize(text):
+    """Lowercase words of `text`, with stop words dropped and plurals folded."""
+
+    tokens = []
+    for word in re.findall(r'[a-z]+', text.lower()):
+        if len(word) < 2 or word in STOP_WORDS:
+            continue
+        tokens.append(fold_plural(word))
+    return tokens
+
+
+class RecipeIndex:
+    """Inverted index over user recipes and cached Spoonacular recipes.
+
+    Built from the database on a background thread and rebuilt there every
+    `max_age` seconds to pick up writes made by other workers; searches use
+    the current index meanwhile (an empty one until the first build lands).
+    Writes in this process are applied once committed, through the recipe
+    cache's `on_store` hook and the session's commit events.
+
+    User recipes are only returned to the user who added them.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.docs = {}
+        self.postings = {}
+        self.built_at = None
+        # Bumped on every change, so derived data (scoring.RecipeScorer)
+        # can tell when it is behind.
+        self.version = 0
+        self._lock = threading.RLock()
+        self._refreshing = False
+        # Changes applied while a rebuild runs, replayed onto its result.
+        self._pending = None
+
+    def search(self, query, allergy_mask=0, diet_mask=0, limit=10, user_id=None):
+        """Rank recipes matching `query` that fit the given restriction masks.
+
+        Returns [{"name", "id", "source"}] where source is "user" or
+        "spoonacular", best ingredient matches first. User recipes are
+        only included if they belong to `user_id`.
+        """
+
+        self.refresh_in_background()
+        terms = set(tokenize(query))
+
+        scores = {}
+        with self._lock:
+            for term in terms:
+                for key, weight in self.postings.get(term, {}).items():
+                    score = scores.setdefault(key, [0, 0])
+                    score[0] += weight == INGREDIENT_WEIGHT
+                    score[1] += weight
+
+            ranked = []
+            for key, (ingredient_hits, weight) in scores.items():
+                doc = self.docs[key]
+                if doc['owner_id'] is not None and doc['owner_id'] != user_id:
+                    continue
+                if not mask_fits(doc['allergen_mask'], doc['diet_mask'],
+                                 allergy_mask, diet_mask):
+                    continue
+                ranked.append((-ingredient_hits, -weight, doc['name'], key))
+
+        ranked.sort()
+        return [{"name": name, "id": key[1], "source": key[0]}
+                for _, _, name, key in ranked[:limit]]
+
+    def add(self, source, recipe_id, name, ingredients, text, allergen_mask,
+            diet_mask, owner_id=None, ready_minutes=None):
+        """Index one recipe, replacing any previous version of it."""
+
+        fields = {}
+        for token in tokenize(text):
+            fields[token] = TEXT_WEIGHT
+        for token in tokenize(name):
+            fields[token] = TITLE_WEIGHT
+        for token in tokenize(' '.join(ingredients)):
+            fields[token] = INGREDIENT_WEIGHT
+
+        self._apply((source, recipe_id), {
+            'name': name, 'tokens': fields, 'allergen_mask': allergen_mask,
+            'diet_mask': diet_mask, 'owner_id': owner_id,
+            'ready_minutes': ready_minutes})
+
+    def remove(self, source, recipe_id):
+        self._apply((source, recipe_id), None)
+
+    def add_cached_recipe(self, recipe_id, data, allergen_mask, diet_mask):
+        self.add('spoonacular', recipe_id, data.get('title', ''),
+                 ingredient_names(data), ' '.join(data.get('dishTypes', [])),
+                 allergen_mask or 0, diet_mask or 0,
+                 ready_minutes=data.get('readyInMinutes'))
+
+    def add_user_recipe(self, recipe):
+        self.add(*self._user_recipe_args(recipe))
+
+    @staticmethod
+    def _user_recipe_args(recipe):
+        """Arguments to `add` for a UserRecipe."""
+
+        ingredients = recipe.ingredients.splitlines()
+        # No diet flags exist for user recipes, so they never satisfy a diet.
+        return ('user', recipe.id, recipe.title, ingredients, recipe.instructions,
+                reference_data.allergy_mask(text_allergens(ingredients)), 0,
+                recipe.user_id)
+
+    def spoonacular_docs(self):
+        """Snapshot of (recipe_id, doc) for every indexed Spoonacular recipe."""
+
+        with self._lock:
+            return [(key[1], doc) for key, doc in self.docs.items()
+                    if key[0] == 'spoonacular']
+
+    def rebuild(self):
+        """Re-index every user recipe and cached Spoonacular recipe.
+
+        The new index is built aside and swapped in, so searches keep using
+        the old one until it is ready.
+        """
+
+        with self._lock:
+            self._pending = []
+        try:
+            fresh = RecipeIndex(self.max_age)
+            for row in CachedRecipe.query.yield_per(500):
+                fresh.add_cached_recipe(row.recipe_id, json.loads(row.data),
+                                        row.allergen_mask, row.diet_mask)
+            for recipe in UserRecipe.query.yield_per(500):
+                fresh.add_user_recipe(recipe)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self.docs, self.postings = fresh.docs, fresh.postings
+            for key, doc in pending:
+                self._put(key, doc)
+            self.built_at = time.monotonic()
+            self.version += 1
+
+    def refresh_in_background(self):
+        """Start a rebuild on a thread if the index is missing or older than `max_age`."""
+
+        with self._lock:
+            if self._refreshing or (
+                    self.built_at is not None
+                    and time.monotonic() - self.built_at <= self.max_age):
+                return
+            self._refreshing = True
+
+        app = current_app._get_current_object()
+
+        def refresh():
+            with app.app_context():
+                try:
+                    self.rebuild()
+                except Exception:
+                    app.logger.exception("Search index rebuild failed")
+                finally:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def watch(self, recipe_cache):
+        """Keep the index in step with this process's committed writes."""
+
+        recipe_cache.on_store.append(self._on_cached_write)
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _apply(self, key, doc):
+        with self._lock:
+            self._put(key, doc)
+            self.version += 1
+            if self._pending is not None:
+                self._pending.append((key, doc))
+
+    def _put(self, key, doc):
+        self._remove(key)
+        if doc is None:
+            return
+        self.docs[key] = doc
+        for token, weight in doc['tokens'].items():
+            self.postings.setdefault(token, {})[key] = weight
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for token in doc['tokens']:
+            postings = self.postings.get(token)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[token]
+
+    def _building(self):
+        """True once a build has started; before that, writes are left to it."""
+
+        return self.built_at is not None or self._pending is not None
+
+    def _on_cached_write(self, recipe_id, data, allergen_mask, diet_mask):
+        if self._building():
+            self.add_cached_recipe(recipe_id, data, allergen_mask, diet_mask)
+
+    def _after_flush(self, session, flush_context):
+        # Values are copied now: after commit the objects are expired and
+        # no SQL can be run.
+        changes = session.info.setdefault('search_index_changes', {})
+        for obj in list(session.new) + list(session.dirty):
+            if isinstance(obj, UserRecipe) and (
+                    obj in session.new or any(
+                        attributes.get_history(obj, name).has_changes()
+                        for name in CONTENT_FIELDS)):
+                changes[obj.id] = self._user_recipe_args(obj)
+        for obj in session.deleted:
+            if isinstance(obj, UserRecipe):
+                changes[obj.id] = None
+
+    def _after_commit(self, session):
+        changes = session.info.pop('search_index_changes', {})
+        if not self._building():
+            return
+        for recipe_id, args in changes.items():
+            if args is None:
+                self.remove('user', recipe_id)
+            else:
+                self.add(*args)
+
+    def _after_rollback(self, session):
+        session.info.pop('search_index_changes', None)
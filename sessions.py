@@ -0,0 +1,404 @@
+"""Server-side sessions and cached user contexts for FoodieFinds.
+
+The session cookie carries only a random id. The data lives in a backend:
+the `session_records` table ("database", shared by every process) or a
+dict ("memory", for a single process). Session data changes on almost any
+request (flashes, form tokens), so it is read from the backend every time,
+a primary-key lookup, and never cached in process. A changed session is
+saved in place, one version up; the write only lands if the stored
+version is older, so of two requests saving the same session at once the
+later one is dropped instead of overwriting the other. The id changes
+only when `session.regenerate` is set, which login and logout do against
+session fixation, so other tabs keep their session through flashes and
+form tokens.
+
+The store also keeps a snapshot of each signed-in user's context (id,
+username, restriction masks, favorite ids), which is what `g.user` holds.
+Snapshots sit behind an in-process LRU, so an authenticated request
+usually reads the users table not at all.
+Snapshots are versioned by users.context_version. Any change to those
+fields bumps the version and, in the same transaction, overwrites the
+snapshot with an empty record at the new version. A snapshot is only
+stored if its version is at least the stored one, so one built from data
+read before the change can't replace the newer record. The writing
+process drops its LRU copy on commit; other processes within
+SESSION_CACHE_TTL seconds.
+"""
+
+import json
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session, attributes
+
+from cache import LRUCache
+from models import db, dialect_insert, FavoriteRecipe, SessionRecord, User
+from reference import reference_data, restriction_bit
+
+# User columns that are part of the cached context.
+CONTEXT_FIELDS = ('username', 'allergy_mask', 'diet_mask')
+
+
+class UserContext:
+    """The signed-in user as routes and templates see it, without the ORM row."""
+
+    def __init__(self, id, username, allergy_mask, diet_mask, favorite_ids, version=0):
+        self.id = id
+        self.username = username
+        self.allergy_mask = allergy_mask
+        self.diet_mask = diet_mask
+        self.favorite_ids = frozenset(favorite_ids)
+        self.version = version
+
+    def __repr__(self):
+        return f"<UserContext #{self.id}: {self.username} v{self.version}>"
+
+    @classmethod
+    def from_user(cls, user):
+        """Snapshot a User loaded with `User.load_context`."""
+
+        return cls(user.id, user.username, user.allergy_mask or 0, user.diet_mask or 0,
+                   [fav_recipe.recipe_id for fav_recipe in user.fav_recipes],
+                   user.context_version or 0)
+
+    @classmethod
+    def from_dict(cls, data, version):
+        return cls(data['id'], data['username'], data['allergy_mask'],
+                   data['diet_mask'], data['favorite_ids'], version)
+
+    def to_dict(self):
+        return {'id': self.id, 'username': self.username,
+                'allergy_mask': self.allergy_mask, 'diet_mask': self.diet_mask,
+                'favorite_ids': sorted(self.favorite_ids)}
+
+    def get_allergies(self):
+        return reference_data.allergy_types(self.allergy_mask)
+
+    def get_diet(self):
+        return reference_data.diet_types(self.diet_mask)
+
+    def has_allergy(self, allergy_id):
+        return allergy_id is not None and bool(self.allergy_mask & restriction_bit(allergy_id))
+
+    def has_diet(self, diet_id):
+        return diet_id is not None and bool(self.diet_mask & restriction_bit(diet_id))
+
+
+class MemoryBackend:
+    """Records in a dict; only for a single process (development, tests)."""
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (data, version, expires_at) for `key`, or None."""
+
+        with self._lock:
+            return self._records.get(key)
+
+    def set(self, key, data, version, expires_at, connection=None, strict=False):
+        """Store the record unless a newer version is stored; return whether it was.
+
+        With `strict`, a stored record at the same version also wins.
+        """
+
+        with self._lock:
+            current = self._records.get(key)
+            if current is not None and (
+                    current[1] >= version if strict else current[1] > version):
+                return False
+            self._records[key] = (data, version, expires_at)
+            return True
+
+    def delete(self, key, connection=None):
+        with self._lock:
+            self._records.pop(key, None)
+
+    def purge_expired(self):
+        now = datetime.utcnow()
+        with self._lock:
+            expired = [key for key, record in self._records.items() if record[2] <= now]
+            for key in expired:
+                del self._records[key]
+        return len(expired)
+
+
+class DatabaseBackend:
+    """Records in the session_records table, shared by every process.
+
+    Each call runs on its own connection, independent of the request's
+    transaction, unless `connection` is passed to write inside one.
+    """
+
+    def get(self, key):
+        """Return (data, version, expires_at) for `key`, or None."""
+
+        with db.engine.connect() as connection:
+            row = connection.execute(
+                select(SessionRecord.data, SessionRecord.version, SessionRecord.expires_at)
+                .where(SessionRecord.key == key)).first()
+        return tuple(row) if row is not None else None
+
+    def set(self, key, data, version, expires_at, connection=None, strict=False):
+        """Upsert the record unless a newer version is stored; return whether it was.
+
+        With `strict`, a stored record at the same version also wins.
+        """
+
+        stmt = dialect_insert(SessionRecord).values(
+            key=key, data=data, version=version, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SessionRecord.key],
+            set_={'data': stmt.excluded.data, 'version': stmt.excluded.version,
+                  'expires_at': stmt.excluded.expires_at},
+            where=(SessionRecord.version < stmt.excluded.version if strict
+                   else SessionRecord.version <= stmt.excluded.version))
+        if connection is not None:
+            return connection.execute(stmt).rowcount == 1
+        with db.engine.begin() as connection:
+            return connection.execute(stmt).rowcount == 1
+
+    def delete(self, key, connection=None):
+        stmt = SessionRecord.__table__.delete().where(SessionRecord.key == key)
+        if connection is not None:
+            connection.execute(stmt)
+            return
+        with db.engine.begin() as connection:
+            connection.execute(stmt)
+
+    def purge_expired(self):
+        with db.engine.begin() as connection:
+            return connection.execute(SessionRecord.__table__.delete().where(
+                SessionRecord.expires_at < datetime.utcnow())).rowcount
+
+
+class SessionStore:
+    """Session data and user contexts: an in-process LRU over a backend.
+
+    `init_app` picks the backend from SESSION_BACKEND, installs the
+    session interface and watches flushes for user context changes.
+    Writes that bypass the ORM (bulk statements) must call
+    `invalidate_user` themselves.
+    """
+
+    def __init__(self):
+        self.backend = None
+        self.memory = None
+        self.ttl = None
+        self.counters = {'memory_hits': 0, 'store_hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if app.config['SESSION_BACKEND'] == 'memory':
+            self.backend = MemoryBackend()
+        else:
+            self.backend = DatabaseBackend()
+        self.ttl = timedelta(seconds=app.config['SESSION_TTL'])
+        self.memory = LRUCache(max_size=app.config['SESSION_CACHE_SIZE'],
+                               ttl=app.config['SESSION_CACHE_TTL'])
+        app.session_interface = ServerSessionInterface(self)
+        event.listen(Session, 'after_flush', self._after_flush)
+        event.listen(Session, 'after_commit', self._after_commit)
+        event.listen(Session, 'after_rollback', self._after_rollback)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _get(self, key, memory=True):
+        """(data, version, expires_at) from the LRU or the backend, or None.
+
+        With `memory=False` the LRU is skipped. Expired records and
+        invalidated user contexts count as misses.
+        """
+
+        if memory:
+            record = self.memory.get(key)
+            if record is not None:
+                self._count('memory_hits')
+                return record
+
+        record = self.backend.get(key)
+        if record is None or record[0] is None or record[2] <= datetime.utcnow():
+            self._count('misses')
+            return None
+        self._count('store_hits')
+        if memory:
+            self._remember(key, record)
+        return record
+
+    def _remember(self, key, record):
+        """Put `record` in the LRU unless it already holds a newer version."""
+
+        with self._lock:
+            current = self.memory.get(key)
+            if current is None or current[1] <= record[1]:
+                self.memory.set(key, record)
+
+    def load_session(self, sid):
+        """Return (serialized data, version, whether its expiry should be pushed back) or None."""
+
+        record = self._get(f'session:{sid}', memory=False)
+        if record is None:
+            return None
+        data, version, expires_at = record
+        return data, version, expires_at - datetime.utcnow() < self.ttl / 2
+
+    def save_session(self, sid, data, version):
+        """Store session data at `version`; False if that version or a newer one is stored."""
+
+        return self.backend.set(f'session:{sid}', data, version,
+                                datetime.utcnow() + self.ttl, strict=True)
+
+    def delete_session(self, sid):
+        self.backend.delete(f'session:{sid}')
+
+    def user_context(self, user_id):
+        """Return the UserContext for `user_id`, or None if there's no such user."""
+
+        key = f'user:{user_id}'
+        record = self._get(key)
+        if record is not None:
+            return UserContext.from_dict(json.loads(record[0]), record[1])
+
+        user = User.load_context(user_id)
+        if user is None:
+            return None
+        context = UserContext.from_user(user)
+        record = (json.dumps(context.to_dict()), context.version,
+                  datetime.utcnow() + self.ttl)
+        if self.backend.set(key, *record):
+            self._remember(key, record)
+        return context
+
+    def invalidate_user(self, user_id, session=None):
+        """Bump the user's context version and drop the snapshot, in `session`'s transaction.
+
+        The caller commits; the LRU copy goes when it does.
+        """
+
+        session = session or db.session
+        connection = session.connection()
+        version = connection.execute(
+            update(User).where(User.id == user_id)
+            .values(context_version=User.context_version + 1)
+            .returning(User.context_version)).scalar()
+        if version is not None:
+            self.backend.set(f'user:{user_id}', None, version,
+                             datetime.utcnow() + self.ttl, connection=connection)
+        session.info.setdefault('stale_user_contexts', set()).add(user_id)
+
+    def purge_expired(self):
+        """Delete expired sessions and snapshots from the backend."""
+
+        return self.backend.purge_expired()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = sum(counters.values())
+        counters['hit_ratio'] = round(
+            (counters['memory_hits'] + counters['store_hits']) / lookups, 4) if lookups else 0.0
+        counters['memory_size'] = len(self.memory) if self.memory is not None else 0
+        return counters
+
+    def _after_flush(self, session, flush_context):
+        changed = set()
+        deleted = set()
+        for obj in session.dirty:
+            if isinstance(obj, User) and any(
+                    attributes.get_history(obj, name).has_changes()
+                    for name in CONTEXT_FIELDS):
+                changed.add(obj.id)
+        for obj in list(session.new) + list(session.deleted):
+            if isinstance(obj, FavoriteRecipe):
+                changed.add(obj.user_id)
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                deleted.add(obj.id)
+
+        for user_id in changed - deleted:
+            self.invalidate_user(user_id, session)
+        for user_id in deleted:
+            self.backend.delete(f'user:{user_id}', connection=session.connection())
+            session.info.setdefault('stale_user_contexts', set()).add(user_id)
+
+    def _after_commit(self, session):
+        for user_id in session.info.pop('stale_user_contexts', ()):
+            self.memory.delete(f'user:{user_id}')
+
+    def _after_rollback(self, session):
+        session.info.pop('stale_user_contexts', None)
+
+
+class ServerSession(SecureCookieSession):
+    """Session dict whose data is kept in the SessionStore under `sid`."""
+
+    def __init__(self, initial=None, sid=None, version=0, refresh=False):
+        super().__init__(initial)
+        self.sid = sid
+        self.version = version
+        self.refresh = refresh
+        # Set when the signed-in user changes, to save under a new id.
+        self.regenerate = False
+
+
+class ServerSessionInterface(SessionInterface):
+    """Flask session interface keeping only the session id in the cookie."""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load_session(sid)
+            if loaded is not None:
+                data, version, refresh = loaded
+                return ServerSession(self.serializer.loads(data), sid=sid,
+                                     version=version, refresh=refresh)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid is not None:
+                self.store.delete_session(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+
+        if not (session.modified or session.refresh):
+            return
+        old_sid = session.sid
+        if session.sid is None or session.regenerate:
+            session.sid = secrets.token_urlsafe(32)
+            session.version = 0
+        self.store.save_session(session.sid, self.serializer.dumps(dict(session)),
+                                session.version + 1)
+        if old_sid is not None and old_sid != session.sid:
+            self.store.delete_session(old_sid)
+        if session.sid != old_sid or session.permanent:
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path,
+                                secure=secure, samesite=samesite)
+
+
+session_store = SessionStore()
@@ -0,0 +1,227 @@
+"""Spoonacular API client for FoodieFinds."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from flask import current_app, has_app_context
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = "https://api.spoonacular.com/recipes"
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SpoonacularClient:
+    """Shared client for every call the app makes to Spoonacular.
+
+    Holds one pooled keep-alive session, applies connect/read timeouts to
+    every request, retries 429/5xx responses with exponential backoff and
+    records call counts and latency per endpoint. With a `limiter` (see
+    quota.QuotaLimiter) every attempt, retries included, first reserves its
+    estimated point cost and reports Spoonacular's quota headers back
+    afterwards.
+
+    `fan_out` runs several calls at once on a shared thread pool of
+    `concurrency` workers, bounded by a per-request `deadline` in seconds.
+    `observer(endpoint, elapsed, ok)`, if given, is called after every call.
+    """
+
+    def __init__(self, api_key, base_url=API_BASE_URL, connect_timeout=3.05,
+                 read_timeout=10, max_retries=2, backoff_factor=0.5,
+                 pool_size=10, limiter=None, concurrency=4, deadline=15,
+                 observer=None):
+        self.api_key = api_key
+        self.limiter = limiter
+        self.observer = observer
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='spoonacular')
+
+        # No adapter-level retries: every attempt has to go through the
+        # limiter, so `get` retries itself.
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size,
+                              max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint, path, params=None):
+        """GET `path` under the base URL and return the decoded JSON body.
+
+        `endpoint` is the name latency is recorded under. 429/5xx answers
+        and connection errors are retried up to `max_retries` times with
+        exponential backoff (or the Retry-After delay); each attempt is a
+        separate call to the limiter, so retries are charged like any
+        other call. Raises requests.HTTPError for non-2xx answers,
+        requests.Timeout if Spoonacular stalls past the configured timeouts
+        and quota.QuotaExceeded if the limiter refuses an attempt.
+        """
+
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = self._attempt(endpoint, path, params)
+            except requests.ConnectionError:
+                if last:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            if response.status_code in RETRY_STATUSES and not last:
+                time.sleep(self._backoff(attempt, response))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def _attempt(self, endpoint, path, params):
+        """Make one limited, timed request and return the response."""
+
+        params = dict(params or {})
+        if self.limiter is not None:
+            self.limiter.acquire(estimate_points(endpoint, params))
+        params['apiKey'] = self.api_key
+
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = self.session.get(f'{self.base_url}/{path}',
+                                        params=params, timeout=self.timeout)
+            if self.limiter is not None:
+                self.limiter.record(response.headers)
+            ok = response.ok
+            return response
+        finally:
+            self._record(endpoint, time.perf_counter() - start, ok)
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before retry number `attempt` + 1."""
+
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.deadline)
+        return self.backoff_factor * 2 ** attempt
+
+    def fan_out(self, calls, deadline=None):
+        """Run zero-argument `calls` concurrently and return their outcomes.
+
+        Results come back in the order of `calls`. A call that raised has
+        its exception in its slot instead of a value; calls still running
+        when `deadline` seconds have passed get a requests.Timeout. Each
+        call runs in its own app context, so it must not share ORM objects
+        with the caller.
+        """
+
+        if not calls:
+            return []
+
+        app = current_app._get_current_object() if has_app_context() else None
+
+        def run(call):
+            if app is None:
+                return call()
+            with app.app_context():
+                return call()
+
+        futures = [self.executor.submit(run, call) for call in calls]
+        done, not_done = wait(
+            futures, timeout=self.deadline if deadline is None else deadline)
+        for future in not_done:
+            future.cancel()
+
+        outcomes = []
+        for future in futures:
+            if future in not_done:
+                outcomes.append(requests.Timeout(
+                    "Spoonacular calls did not finish before the deadline."))
+            elif future.exception() is not None:
+                outcomes.append(future.exception())
+            else:
+                outcomes.append(future.result())
+        return outcomes
+
+    def complex_search(self, **params):
+        """Run a complexSearch query."""
+
+        return self.get('complexSearch', 'complexSearch', params)
+
+    def recipe_information(self, recipe_id):
+        """Fetch information for a single recipe."""
+
+        return self.get('information', f'{recipe_id}/information',
+                        {'includeNutrition': 'false'})
+
+    def information_bulk(self, recipe_ids, chunk_size=50):
+        """Fetch information for many recipes through informationBulk.
+
+        Ids are sent `chunk_size` at a time and the chunks are fetched
+        concurrently. Returns a dict of recipe id -> information; ids
+        Spoonacular doesn't know are left out. If only some chunks fail,
+        the ones that succeeded are still returned; if every chunk fails,
+        the first error is raised.
+        """
+
+        chunks = [recipe_ids[start:start + chunk_size]
+                  for start in range(0, len(recipe_ids), chunk_size)]
+        outcomes = self.fan_out([self._bulk_call(chunk) for chunk in chunks])
+
+        recipes = {}
+        errors = []
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                errors.append(outcome)
+                continue
+            for recipe in outcome:
+                recipes[recipe['id']] = recipe
+        if errors and not recipes:
+            raise errors[0]
+        return recipes
+
+    def _bulk_call(self, chunk):
+        params = {'ids': ','.join(str(recipe_id) for recipe_id in chunk),
+                  'includeNutrition': 'false'}
+        return lambda: self.get('informationBulk', 'informationBulk', params)
+
+    def stats(self):
+        """Return per-endpoint call counts, errors and latency in ms."""
+
+        with self._lock:
+            stats = {}
+            for endpoint, m in self.metrics.items():
+                stats[endpoint] = {
+                    'calls': m['calls'],
+                    'errors': m['errors'],
+                    'avg_ms': round(m['total'] / m['calls'] * 1000, 2),
+                    'max_ms': round(m['max'] * 1000, 2),
+                }
+            return stats
+
+    def _record(self, endpoint, elapsed, ok):
+        with self._lock:
+            m = self.metrics.setdefault(
+                endpoint, {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0})
+            m['calls'] += 1
+            m['total'] += elapsed
+            m['max'] = max(m['max'], elapsed)
+            if not ok:
+                m['errors'] += 1
+        if self.observer is not None:
+            self.observer(endpoint, elapsed, ok)
+
+
+def estimate_points(endpoint, params):
+    """Estimate the quota points a Spoonacular call will cost."""
+
+    if endpoint == 'complexSearch':
+        return 1 + 0.01 * int(params.get('number', 10))
+    if endpoint == 'informationBulk':
+        count = len(str(params.get('ids', '')).split(','))
+        return 1 + 0.5 * (count - 1)
+    return 1
@@ -0,0 +1,111 @@
+"""Run the app's test profile against a scratch SQLite database."""
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='foodiefinds-tests-'), 'test.db')
+os.environ['APP_PROFILE'] = 'test'
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['SPOONACULAR_API_KEY'] = 'test'
+
+
+def remove_database():
+    """Close pooled connections and delete the scratch database.
+
+    In-process caches are emptied too, so nothing from an earlier test
+    outlives its database.
+    """
+
+    import app as foodiefinds
+    from models import db
+    from reference import reference_data
+    from sessions import session_store
+
+    with foodiefinds.app.app_context():
+        db.engine.dispose()
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+
+    for cache in (foodiefinds.recipe_cache, foodiefinds.search_cache,
+                  foodiefinds.fragment_cache):
+        cache.memory.clear()
+    if session_store.memory is not None:
+        session_store.memory.clear()
+    foodiefinds.feed_pools.pools.clear()
+    foodiefinds.recipe_index.docs = {}
+    foodiefinds.recipe_index.postings = {}
+    foodiefinds.recipe_index.built_at = None
+    foodiefinds.recipe_scorer = None
+    reference_data.invalidate()
+
+
+@pytest.fixture
+def app():
+    """The app on a fresh, migrated and seeded database."""
+
+    from app import create_app
+
+    remove_database()
+    flask_app = create_app('test')
+    with flask_app.app_context():
+        yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture(scope='session')
+def fake_api():
+    """benchmarks/fake_spoonacular.py served on a local port, as load_test.py does."""
+
+    from werkzeug.serving import make_server
+    from benchmarks.fake_spoonacular import FakeSpoonacular, create_fake_app
+
+    fake = FakeSpoonacular(seed=0)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, create_fake_app(fake), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fake.url = f'http://127.0.0.1:{server.server_port}/recipes'
+    yield fake
+    server.shutdown()
+
+
+@pytest.fixture
+def spoonacular(app, fake_api, monkeypatch):
+    """The app's Spoonacular client, pointed at `fake_api`."""
+
+    import app as foodiefinds
+
+    monkeypatch.setattr(foodiefinds.spoonacular, 'base_url', fake_api.url)
+    return foodiefinds.spoonacular
+
+
+
+def sign_up(client, username='tester', password='secret1'):
+    """Sign up through the form, which also logs the client in; return the user id."""
+
+    from models import User
+
+    response = client.post('/signup', data={'username': username,
+                                            'email': f'{username}@example.com',
+                                            'password': password})
+    assert response.status_code == 302
+    return User.query.filter_by(username=username).one().id
+
+
+def session_id(client):
+    """The session id in the client's cookie, or None."""
+
+    for cookie in client.cookie_jar:
+        if cookie.name == 'session':
+            return cookie.value
+    return None
@@ -0,0 +1,120 @@
+"""The in-memory LRU and the two-tier recipe cache."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import cache
+from cache import LRUCache, RecipeCache
+from models import db, CachedRecipe
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'monotonic', clock)
+    return clock
+
+
+def recipe(recipe_id):
+    return {'id': recipe_id, 'title': f'Recipe {recipe_id}', 'extendedIngredients': [],
+            'diets': [], 'readyInMinutes': 20}
+
+
+class Loader:
+    """Stands in for Spoonacular; records the ids it was asked for."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, recipe_id):
+        self.calls.append(recipe_id)
+        return recipe(recipe_id)
+
+
+def test_lru_returns_what_was_set_until_it_expires(clock):
+    lru = LRUCache(max_size=10, ttl=60)
+    lru.set('a', 1)
+    lru.set('b', 2, ttl=10)
+    assert (lru.get('a'), lru.get('b')) == (1, 2)
+
+    clock.now += 30
+    assert (lru.get('a'), lru.get('b')) == (1, None)
+    clock.now += 30
+    assert lru.get('a') is None
+    assert len(lru) == 0
+
+
+def test_lru_evicts_least_recently_used(clock):
+    lru = LRUCache(max_size=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert (lru.get('a'), lru.get('b'), lru.get('c')) == (1, None, 3)
+
+
+def test_recipe_cache_tiers_and_counters(app):
+    loader = Loader()
+    recipes = RecipeCache(loader, max_size=10)
+
+    assert recipes.get(1)['title'] == 'Recipe 1'
+    assert recipes.get(1)['title'] == 'Recipe 1'
+    recipes.memory.clear()
+    assert recipes.get(1)['title'] == 'Recipe 1'
+
+    assert loader.calls == [1]
+    stats = recipes.stats()
+    assert (stats['misses'], stats['memory_hits'], stats['db_hits']) == (1, 1, 1)
+    assert stats['hit_ratio'] == round(2 / 3, 4)
+
+
+def test_recipe_cache_expires_in_both_tiers(app, clock):
+    loader = Loader()
+    recipes = RecipeCache(loader, ttl=60, max_size=10)
+    recipes.get(1)
+
+    clock.now += 61
+    db.session.query(CachedRecipe).update(
+        {CachedRecipe.expires_at: datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    recipes.get(1)
+    assert loader.calls == [1, 1]
+    assert recipes.stats()['misses'] == 2
+
+
+def test_recipe_cache_memory_tier_is_size_bounded(app):
+    loader = Loader()
+    recipes = RecipeCache(loader, max_size=2)
+    recipes.get_many([1, 2, 3])
+
+    assert len(recipes.memory) == 2
+    assert recipes.memory.get(1) is None
+    # The evicted recipe comes back from the table, not the loader.
+    assert recipes.get(1)['title'] == 'Recipe 1'
+    assert loader.calls == [1, 2, 3]
+
+
+def test_recipe_cache_table_is_trimmed_to_db_max_size(app):
+    recipes = RecipeCache(Loader(), db_max_size=3)
+    recipes.set_many({recipe_id: recipe(recipe_id) for recipe_id in (1, 2, 3)})
+
+    # Recipe 2 was read most recently, then 3, then 1.
+    now = datetime.utcnow()
+    for recipe_id, minutes_ago in ((1, 30), (2, 10), (3, 20)):
+        db.session.query(CachedRecipe).filter_by(recipe_id=recipe_id).update(
+            {CachedRecipe.accessed_at: now - timedelta(minutes=minutes_ago)})
+    db.session.commit()
+
+    recipes.set_many({4: recipe(4), 5: recipe(5)})
+    kept = {recipe_id for recipe_id, in db.session.query(CachedRecipe.recipe_id)}
+    assert kept == {2, 4, 5}
@@ -0,0 +1,78 @@
+"""Upgrading a database created before there were migrations."""
+
+import sqlite3
+
+import bcrypt
+
+from conftest import DB_PATH, remove_database
+
+# The schema `db.create_all()` made from the original models.
+ORIGINAL_SCHEMA = """
+CREATE TABLE users (
+    id INTEGER NOT NULL, username VARCHAR NOT NULL, email VARCHAR NOT NULL,
+    password VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (username));
+CREATE TABLE diet_prefs (id INTEGER NOT NULL, type TEXT, PRIMARY KEY (id));
+CREATE TABLE allergies (id INTEGER NOT NULL, type TEXT, PRIMARY KEY (id));
+CREATE TABLE fav_recipes (
+    user_id INTEGER NOT NULL, recipe_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, recipe_id), FOREIGN KEY(user_id) REFERENCES users (id));
+CREATE TABLE user_allergies (
+    user_id INTEGER NOT NULL, allergy_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, allergy_id), FOREIGN KEY(user_id) REFERENCES users (id),
+    FOREIGN KEY(allergy_id) REFERENCES allergies (id));
+CREATE TABLE user_diet_prefs (
+    user_id INTEGER NOT NULL, diet_prefs_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, diet_prefs_id), FOREIGN KEY(user_id) REFERENCES users (id),
+    FOREIGN KEY(diet_prefs_id) REFERENCES diet_prefs (id));
+CREATE TABLE user_recipes (
+    id INTEGER NOT NULL, title TEXT NOT NULL, photo_url TEXT, ingredients TEXT NOT NULL,
+    instructions TEXT NOT NULL, user_id INTEGER, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES users (id));
+"""
+
+
+def make_original_database():
+    remove_database()
+    password = bcrypt.hashpw(b'secret1', bcrypt.gensalt(4)).decode('UTF-8')
+    with sqlite3.connect(DB_PATH) as connection:
+        connection.executescript(ORIGINAL_SCHEMA)
+        connection.executemany('INSERT INTO allergies (type) VALUES (?)',
+                               [('Dairy',), ('Egg',), ('Gluten',)])
+        connection.executemany('INSERT INTO diet_prefs (type) VALUES (?)',
+                               [('Gluten Free',), ('Ketogenic',), ('Vegetarian',)])
+        connection.execute("INSERT INTO users (username, email, password) "
+                           "VALUES ('olduser', 'old@example.com', ?)", (password,))
+        connection.execute('INSERT INTO fav_recipes VALUES (1, 715538)')
+        connection.executemany('INSERT INTO user_allergies VALUES (1, ?)', [(1,), (2,)])
+        connection.execute('INSERT INTO user_diet_prefs VALUES (1, 3)')
+
+
+def test_upgrade_original_database_then_log_in():
+    make_original_database()
+
+    from app import create_app
+    from models import db, User
+
+    # The test profile runs pending migrations, as `init-db` does.
+    app = create_app('test')
+    with app.app_context():
+        tables = set(db.inspect(db.engine).get_table_names())
+        assert {'cached_recipes', 'cached_searches', 'api_quota', 'feed_pools',
+                'jobs', 'session_records'} <= tables
+
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'olduser', 'password': 'secret1'})
+    assert response.status_code == 302
+    assert response.headers['Location'] == '/'
+
+    response = client.get('/profile/1')
+    assert response.status_code == 200
+    assert b'olduser' in response.data
+    assert b'Dairy' in response.data and b'Vegetarian' in response.data
+
+    with app.app_context():
+        user = db.session.get(User, 1)
+        assert [fav.recipe_id for fav in user.fav_recipes] == [715538]
+        # Backfilled from user_allergies (1, 2) and user_diet_prefs (3).
+        assert (user.allergy_mask, user.diet_mask) == (0b11, 0b100)
+        assert user.has_allergy(2) and not user.has_allergy(3)
@@ -0,0 +1,74 @@
+"""SQL statements per page stay within budget and don't grow with a user's data.
+
+Each page is requested once to warm the caches, then counted on the
+second request, for a user with no allergies, diets or favorites and for
+one with all of them.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from models import (db, User, Allergy, DietaryPreference, UserAllergy, UserDiet,
+                    FavoriteRecipe)
+
+# Statement budget per page, for a request after the first.
+MAX_STATEMENTS = {
+    '/': 1,
+    '/recipes/{recipe_id}': 1,
+    '/profile/{user_id}': 4,
+    '/user-recipes': 2,
+    '/fav-recipes': 2,
+}
+RECIPE_ID = 715538
+
+
+def make_user(username, with_restrictions):
+    user = User.signup(username=username, email=f'{username}@example.com',
+                       password='benchmark')
+    db.session.flush()
+
+    if with_restrictions:
+        for allergy in Allergy.query.all():
+            db.session.add(UserAllergy(user_id=user.id, allergy_id=allergy.id))
+        for diet in DietaryPreference.query.all():
+            db.session.add(UserDiet(user_id=user.id, diet_prefs_id=diet.id))
+        for recipe_id in range(1, 51):
+            fav_recipe = FavoriteRecipe(user_id=user.id, recipe_id=recipe_id)
+            fav_recipe.update_snapshot({'title': f'Recipe {recipe_id}'})
+            db.session.add(fav_recipe)
+    db.session.commit()
+    return user.id
+
+
+def count_statements(client, path):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    db.session.remove()
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(path)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert response.status_code == 200, (path, response.status_code)
+    return len(statements)
+
+
+@pytest.mark.parametrize('path', MAX_STATEMENTS)
+def test_statements_per_page(app, spoonacular, path):
+    from app import CURR_USER_KEY
+
+    counts = []
+    for username, with_restrictions in [('plain', False), ('restricted', True)]:
+        user_id = make_user(username, with_restrictions)
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        url = path.format(user_id=user_id, recipe_id=RECIPE_ID)
+        count_statements(client, url)
+        counts.append(count_statements(client, url))
+
+    assert counts[0] == counts[1]
+    assert counts[0] <= MAX_STATEMENTS[path]
@@ -0,0 +1,90 @@
+"""The shared Spoonacular token bucket and daily points budget."""
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import quota
+from quota import QuotaLimiter, QuotaExceeded
+from spoonacular import SpoonacularClient
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Waits the limiter would have slept, without sleeping."""
+
+    sleeps = []
+    monkeypatch.setattr(quota.time, 'sleep', sleeps.append)
+    return sleeps
+
+
+def response(status, headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp._content = b'{"results": []}'
+    return resp
+
+
+def test_budget_refuses_calls_that_would_overspend(app):
+    limiter = QuotaLimiter(daily_points=5, burst=10)
+    limiter.acquire(3)
+    with pytest.raises(QuotaExceeded, match='quota'):
+        limiter.acquire(3)
+    limiter.acquire(2)
+
+    stats = limiter.stats()
+    assert (stats['points_used'], stats['requests'], stats['rejected']) == (5, 2, 1)
+    assert limiter.points_left() == 0
+
+
+def test_token_bucket_waits_for_a_token(app, sleeps):
+    limiter = QuotaLimiter(rate=10, burst=1, max_wait=1)
+    limiter.acquire()
+    limiter.acquire()
+    assert len(sleeps) == 1 and 0 < sleeps[0] <= 0.1
+
+
+def test_token_bucket_refuses_waits_over_max_wait(app, sleeps):
+    limiter = QuotaLimiter(rate=0.1, burst=1, max_wait=1)
+    limiter.acquire()
+    with pytest.raises(QuotaExceeded, match='rate limit'):
+        limiter.acquire()
+    assert sleeps == []
+    assert limiter.stats()['rejected'] == 1
+
+
+def test_quota_headers_replace_the_estimates(app):
+    limiter = QuotaLimiter(daily_points=150, burst=10)
+    limiter.acquire(1)
+    limiter.record({'X-API-Quota-Used': '140', 'X-API-Quota-Left': '4'})
+
+    assert limiter.stats()['points_used'] == 140
+    assert limiter.points_left() == 4
+    with pytest.raises(QuotaExceeded):
+        limiter.acquire(5)
+
+
+def test_every_retry_is_charged(app, monkeypatch):
+    limiter = QuotaLimiter(daily_points=10, burst=10)
+    client = SpoonacularClient('key', base_url='http://spoonacular.invalid',
+                               limiter=limiter, max_retries=2, backoff_factor=0)
+    answers = [response(503), response(429), response(200)]
+    monkeypatch.setattr(client.session, 'get', lambda *args, **kwargs: answers.pop(0))
+
+    assert client.complex_search(query='rice', number=0) == {'results': []}
+    stats = limiter.stats()
+    assert (stats['requests'], stats['points_used']) == (3, 3)
+
+
+def test_retry_refused_when_budget_runs_out(app, monkeypatch):
+    limiter = QuotaLimiter(daily_points=1.5, burst=10)
+    client = SpoonacularClient('key', base_url='http://spoonacular.invalid',
+                               limiter=limiter, max_retries=2, backoff_factor=0)
+    calls = []
+    monkeypatch.setattr(client.session, 'get',
+                        lambda *args, **kwargs: calls.append(args) or response(503))
+
+    with pytest.raises(QuotaExceeded):
+        client.complex_search(query='rice', number=0)
+    assert len(calls) == 1
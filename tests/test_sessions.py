@@ -0,0 +1,99 @@
+"""Server-side sessions and the cached user context behind g.user."""
+
+import json
+from datetime import datetime, timedelta
+
+import flask
+import pytest
+
+from app import create_app
+from conftest import sign_up, session_id
+from models import db
+from sessions import session_store
+
+
+def current_user(client, path='/user-recipes'):
+    """g.user as the next request sees it."""
+
+    with client:
+        client.get(path)
+        return flask.g.user
+
+
+def test_restriction_edits_reach_g_user_on_next_request(client):
+    user_id = sign_up(client)
+    assert current_user(client).allergy_mask == 0
+
+    response = client.post(f'/profile/{user_id}/edit', data={
+        'username': 'tester', 'email': 'tester@example.com',
+        'allergies': ['1', '2'], 'diet_prefs': ['3']})
+    assert response.status_code == 302
+    user = current_user(client)
+    assert (user.allergy_mask, user.diet_mask) == (0b11, 0b100)
+    assert user.get_allergies() == ['Dairy', 'Egg']
+
+    client.post('/remove-allergy/2')
+    user = current_user(client)
+    assert (user.allergy_mask, user.diet_mask) == (0b1, 0b100)
+
+
+def test_favorites_update_favorite_ids(client, spoonacular):
+    sign_up(client)
+
+    client.post('/fav-recipes/715538')
+    assert current_user(client).favorite_ids == {715538}
+
+    client.post('/fav-recipes/715538/delete')
+    assert current_user(client).favorite_ids == set()
+
+
+def test_stale_user_context_cannot_replace_newer(client):
+    user_id = sign_up(client)
+    old = session_store.user_context(user_id)
+
+    session_store.invalidate_user(user_id)
+    db.session.commit()
+
+    expires_at = datetime.utcnow() + timedelta(days=1)
+    assert not session_store.backend.set(f'user:{user_id}', json.dumps(old.to_dict()),
+                                         old.version, expires_at)
+    assert session_store.user_context(user_id).version == old.version + 1
+
+
+def test_session_id_changes_on_login_and_logout_only(client):
+    # Redirects to /login with a flash, which starts an anonymous session.
+    client.get('/fav-recipes')
+    anonymous = session_id(client)
+    assert anonymous is not None
+
+    sign_up(client)
+    logged_in = session_id(client)
+    assert logged_in != anonymous
+    assert session_store.backend.get(f'session:{anonymous}') is None
+
+    # Showing the welcome flash changes the session but keeps its id.
+    client.get('/user-recipes')
+    assert session_id(client) == logged_in
+
+    client.get('/logout')
+    assert session_id(client) not in (None, logged_in)
+    assert session_store.backend.get(f'session:{logged_in}') is None
+    assert current_user(client) is None
+
+
+def test_stale_session_save_is_refused(client):
+    sign_up(client)
+    sid = session_id(client)
+    data, version, _ = session_store.backend.get(f'session:{sid}')
+
+    # Another request already saved this version.
+    assert not session_store.save_session(sid, data, version)
+    assert session_store.save_session(sid, data, version + 1)
+    assert session_store.backend.get(f'session:{sid}')[1] == version + 1
+
+
+def test_production_requires_secret_key(app, monkeypatch):
+    monkeypatch.delenv('SECRET_KEY', raising=False)
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        create_app('production')
+    assert app.config['APP_PROFILE'] == 'test'
@@ -0,0 +1,43 @@
+"""Background worker for FoodieFinds.
+
+Runs jobs queued by the web app (recipe prefetches, favorite snapshot
+refreshes, feed pool refills) and periodically queues the stale recipe
+refresh, feed pool warm-up and expired session purge. Run one or more
+next to the web workers:
+
+    python worker.py            # run until interrupted
+    python worker.py --drain    # run every due job, then exit
+"""
+
+import argparse
+
+from app import create_app, job_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drain', action='store_true',
+                        help="run every due job, then exit")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.drain:
+            while job_queue.run_one():
+                pass
+            return
+
+        job_queue.run(
+            poll_interval=app.config['JOB_POLL_INTERVAL'],
+            periodic={
+                'refresh_stale_recipes': app.config['RECIPE_REFRESH_INTERVAL'],
+                'warm_feed_pools': app.config['FEED_WARM_INTERVAL'],
+                'purge_sessions': app.config['SESSION_PURGE_INTERVAL'],
+            })
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass